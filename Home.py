@@ -1,7 +1,11 @@
 import streamlit as st
+from preload import start_preload
 
 st.set_page_config(page_title="Wildfire Monitoring", layout="wide")
 
+# Warm the imports of the other pages while the landing page is read
+start_preload()
+
 # Customize the sidebar
 markdown = """
 This is a test app for PIP Challenge 2024. The app demonstrates how to monitor wildfires using satellite data.
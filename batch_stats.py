@@ -0,0 +1,81 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from index_stats import CLOUD_COVER_THRESHOLD, INDICES, TIME_INTERVAL, daily_statistics, statistics_arrays
+
+# Index statistics for many AOIs at once, returned as one long-format table with the
+# columns aoi_id, date, index, mean, stdev and count. Dates are the day each P1D
+# interval starts on.
+
+# AOIs fetched at the same time, the shared rate limiter still bounds the request rate
+MAX_AOI_WORKERS = 8
+
+COLUMNS = ["aoi_id", "date", "index", "mean", "stdev", "count"]
+
+
+def load_aois(path):
+    # Reads the polygons of a GeoJSON FeatureCollection, keyed by the feature id or its
+    # "id" or "name" property, falling back to the position of the feature
+    with open(path) as f:
+        collection = json.load(f)
+    aois = {}
+    for number, feature in enumerate(collection["features"]):
+        properties = feature.get("properties") or {}
+        aoi_id = feature.get("id") or properties.get("id") or properties.get("name") or number
+        aois[str(aoi_id)] = feature["geometry"]
+    return aois
+
+
+def long_frame(aoi_id, response):
+    # Parsed as float64, which holds pixel counts exactly far beyond the 2^24 of float32
+    dates, values = statistics_arrays(
+        response, stats=("mean", "stDev", "sampleCount", "noDataCount"), date_field="from", dtype=np.float64
+    )
+    return pd.DataFrame({
+        "aoi_id": aoi_id,
+        "date": np.repeat(dates, len(INDICES)),
+        "index": np.tile(INDICES, len(dates)),
+        "mean": values[:, :, 0].ravel().astype(np.float32),
+        "stdev": values[:, :, 1].ravel().astype(np.float32),
+        "count": (values[:, :, 2] - values[:, :, 3]).ravel(),
+    }, columns=COLUMNS)
+
+
+def batch_statistics(aois, time_interval=TIME_INTERVAL, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    # aois maps an AOI id to a (west, south, east, north) bbox or a GeoJSON geometry
+    with ThreadPoolExecutor(max_workers=MAX_AOI_WORKERS) as pool:
+        futures = {
+            aoi_id: pool.submit(daily_statistics, aoi, time_interval, cloud_cover_threshold)
+            for aoi_id, aoi in aois.items()
+        }
+        frames = [long_frame(aoi_id, future.result()) for aoi_id, future in futures.items()]
+
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    # Compact column types, so that hundreds of AOIs over years of days stay small
+    df = df.dropna(subset=["mean"]).reset_index(drop=True)
+    df["aoi_id"] = df["aoi_id"].astype("category")
+    df["index"] = pd.Categorical(df["index"], categories=INDICES)
+    df["count"] = df["count"].fillna(0).astype("int64")
+    return df
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Index statistics for all AOIs of a GeoJSON file")
+    parser.add_argument("aois", help="GeoJSON FeatureCollection with one polygon per AOI")
+    parser.add_argument("--output", required=True, help="output table, .parquet or .csv")
+    parser.add_argument("--start", default=TIME_INTERVAL[0][:10], help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", default=TIME_INTERVAL[1][:10], help="day after the last one, an empty value means today")
+    args = parser.parse_args()
+
+    time_interval = (f"{args.start}T00:00:00Z", f"{args.end}T00:00:00Z" if args.end else None)
+    df = batch_statistics(load_aois(args.aois), time_interval)
+    if args.output.endswith(".parquet"):
+        df.to_parquet(args.output, index=False)
+    else:
+        df.to_csv(args.output, index=False)
+    print(f"{len(df)} rows for {df['aoi_id'].nunique()} AOIs written to {args.output}")
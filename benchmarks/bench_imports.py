@@ -0,0 +1,53 @@
+import argparse
+import ast
+import glob
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures the cold import cost of every Streamlit page: the module level imports of the
+# page are run in a fresh interpreter that has only loaded streamlit, as on the first hit
+# of the page after a server restart. With --preload the modules of preload.py are
+# imported first, as on a first hit after the background preload finished.
+# Example: python benchmarks/bench_imports.py --repeat 5 --preload
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TIMER = """
+import sys, time
+sys.path.insert(0, {root!r})
+import streamlit
+{setup}
+start = time.perf_counter()
+{imports}
+print(time.perf_counter() - start)
+"""
+
+
+def page_imports(path):
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def cold_import_time(imports, setup=""):
+    output = subprocess.run(
+        [sys.executable, "-c", TIMER.format(root=ROOT, imports=imports, setup=setup)],
+        capture_output=True, text=True, check=True, cwd=ROOT,
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cold import time of the Streamlit pages")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--preload", action="store_true", help="import the preload modules before timing")
+    args = parser.parse_args()
+    setup = "from preload import PRELOAD_MODULES, preload; preload(PRELOAD_MODULES)" if args.preload else ""
+
+    pages = [os.path.join(ROOT, "Home.py")] + sorted(glob.glob(os.path.join(ROOT, "pages", "*.py")))
+    for path in pages:
+        imports = page_imports(path)
+        timings = [cold_import_time(imports, setup) for _ in range(args.repeat)]
+        print(f"{os.path.basename(path):50} {statistics.median(timings) * 1000:8.0f} ms")
@@ -0,0 +1,78 @@
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index_stats import parse_statistics  # noqa: E402
+
+# Compares the per-interval loop the index pages used to parse Statistical API responses
+# with the single-pass NumPy parser, on a synthetic daily response.
+# Example: python benchmarks/bench_parse.py --days 3650
+
+
+def synthetic_response(days, empty_ratio):
+    start = date(2015, 1, 1)
+    data = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        interval = {"from": f"{day}T00:00:00Z", "to": f"{day + timedelta(days=1)}T00:00:00Z"}
+        if random.random() < empty_ratio:
+            data.append({"interval": interval, "outputs": {}})
+            continue
+        bands = {
+            f"B{band}": {"stats": {"min": 0.0, "max": 1.0, "mean": random.random(), "stDev": random.random(),
+                                   "sampleCount": 1024, "noDataCount": 12}}
+            for band in range(3)
+        }
+        data.append({"interval": interval, "outputs": {"default": {"bands": bands}}})
+    return [{"data": data}]
+
+
+def loop_parse(response):
+    columns = {name: [] for name in ("NDVI", "NDVI_StdDev", "NBR", "NBR_StdDev", "BAI", "BAI_StdDev")}
+    dates = []
+    for interval in response[0]['data']:
+        dates.append(interval['interval']['to'])
+        for band, name in enumerate(("NDVI", "NBR", "BAI")):
+            if 'default' in interval['outputs']:
+                stats = interval['outputs']['default']['bands'][f"B{band}"]['stats']
+                columns[name].append(stats['mean'])
+                columns[f"{name}_StdDev"].append(stats['stDev'])
+            else:
+                columns[name].append(None)
+                columns[f"{name}_StdDev"].append(None)
+    df = pd.DataFrame({'Date': dates, **columns})
+    for name in columns:
+        df[name] = pd.to_numeric(df[name], errors='coerce')
+    return df
+
+
+def best_of(function, response, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = function(response)
+        timings.append(time.perf_counter() - start)
+    return min(timings), df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark Statistical API response parsing")
+    parser.add_argument("--days", type=int, default=3650)
+    parser.add_argument("--empty-ratio", type=float, default=0.6, help="share of intervals without data")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    response = synthetic_response(args.days, args.empty_ratio)
+    loop_time, loop_df = best_of(loop_parse, response, args.repeat)
+    numpy_time, numpy_df = best_of(parse_statistics, response, args.repeat)
+    print(f"intervals:    {args.days}")
+    print(f"loop:         {loop_time * 1000:.2f} ms, {loop_df.memory_usage(deep=True).sum() / 1024:.0f} KiB")
+    print(f"numpy:        {numpy_time * 1000:.2f} ms, {numpy_df.memory_usage(deep=True).sum() / 1024:.0f} KiB")
+    print(f"speedup:      {loop_time / numpy_time:.1f}x")
@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import math
+import statistics
+import time
+
+import httpx
+
+# Measures tiles/sec and tile latency of the proxy under concurrent load.
+# Example: python benchmarks/bench_proxy.py --base-url http://localhost:5000 --concurrency 32
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def tile_paths(mosaic, lon, lat, zoom, radius):
+    cx, cy = lonlat_to_tile(lon, lat, zoom)
+    return [
+        f"{mosaic}/gmap/{zoom}/{x}/{y}.png"
+        for x in range(cx - radius, cx + radius + 1)
+        for y in range(cy - radius, cy + radius + 1)
+    ]
+
+
+async def run(base_url, paths, total, concurrency):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(paths[i % len(paths)])
+
+    async def worker(client):
+        nonlocal errors
+        while not queue.empty():
+            path = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.get(f"{base_url}/tiles/{path}")
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"requests:    {total} ({errors} errors)")
+    print(f"concurrency: {concurrency}")
+    print(f"tiles/sec:   {total / elapsed:.1f}")
+    print(f"p50 latency: {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"p95 latency: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    print(f"p99 latency: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the tile proxy")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--mosaic", default="global_monthly_2024_08_mosaic")
+    parser.add_argument("--center", type=float, nargs=2, default=[-14.2, -63.11], metavar=("LAT", "LON"))
+    parser.add_argument("--zoom", type=int, default=10)
+    parser.add_argument("--radius", type=int, default=3, help="tiles around the center tile")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    lat, lon = args.center
+    paths = tile_paths(args.mosaic, lon, lat, args.zoom, args.radius)
+    asyncio.run(run(args.base_url.rstrip("/"), paths, args.requests, args.concurrency))
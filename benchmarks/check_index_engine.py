@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index_engine import BANDS, PERCENTILE_METHOD, STDEV_DDOF, fetch_scene, scene_statistics  # noqa: E402
+from index_stats import BBOX, CLOUD_COVER_THRESHOLD, COLLECTION_ID, INDICES, aoi_kwargs, build_evalscript  # noqa: E402
+
+# Checks the local index engine against the Statistical API. --record downloads the raw
+# bands of one acquisition with fetch_scene and the Statistical API response for the same
+# pixels, and saves both as a fixture. Without --record, scene_statistics is run offline on
+# the fixture with every standard deviation ddof and percentile interpolation, and the
+# combination matching the API is compared with STDEV_DDOF and PERCENTILE_METHOD.
+# Example: python benchmarks/check_index_engine.py --record --day 2024-08-20
+#          python benchmarks/check_index_engine.py
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+PERCENTILES = (10, 50, 90)
+DDOFS = (0, 1)
+PERCENTILE_METHODS = ("higher", "lower", "nearest", "midpoint", "linear")
+
+
+def fixture_paths(name):
+    return os.path.join(FIXTURES, f"{name}.npz"), os.path.join(FIXTURES, f"{name}.json")
+
+
+def fetch_reference(aoi, day, shape, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    # Statistical API response of the index evalscript on the grid of the fetched scene.
+    # The percentile interpolation is left to the API default, that is what is checked.
+    from datetime import date, timedelta
+    from sentinelhub import SentinelHubStatistical
+    from sh_client import get_sentinel_hub_client
+
+    time_range = {"from": f"{day}T00:00:00Z", "to": f"{date.fromisoformat(day) + timedelta(days=1)}T00:00:00Z"}
+    client = get_sentinel_hub_client()
+    request = SentinelHubStatistical(
+        aggregation={
+            "timeRange": time_range,
+            "aggregationInterval": {"of": "P1D"},
+            "width": shape[1],
+            "height": shape[0],
+            "evalscript": build_evalscript(cloud_cover_threshold)
+        },
+        input_data=[{"type": COLLECTION_ID, "dataFilter": {"timeRange": time_range}}],
+        calculations={"default": {"statistics": {"default": {"percentiles": {"k": list(PERCENTILES)}}}}},
+        config=client.config,
+        **aoi_kwargs(aoi)
+    )
+    return client.get_data(request)
+
+
+def record(name, aoi, day, cloud_cover_threshold):
+    bands = fetch_scene(aoi, day)
+    response = fetch_reference(aoi, day, bands["dataMask"].shape, cloud_cover_threshold)
+    bands_path, response_path = fixture_paths(name)
+    os.makedirs(FIXTURES, exist_ok=True)
+    np.savez_compressed(bands_path, **bands)
+    with open(response_path, "w") as f:
+        json.dump({"aoi": list(aoi), "day": day, "cloud_cover_threshold": cloud_cover_threshold,
+                   "percentiles": list(PERCENTILES), "response": response}, f)
+    print(f"recorded {bands_path} and {response_path}")
+
+
+def remote_statistics(response):
+    # Statistics of every index in the single interval of the response
+    intervals = [interval for interval in response[0]["data"] if "default" in interval["outputs"]]
+    if not intervals:
+        raise SystemExit("the recorded response has no statistics, record a day with an acquisition")
+    bands = intervals[0]["outputs"]["default"]["bands"]
+    return {name: bands[f"B{band}"]["stats"] for band, name in enumerate(INDICES)}
+
+
+def relative_error(local, remote):
+    local, remote = float(local), float(remote)
+    if np.isnan(local) and np.isnan(remote):
+        return 0.0
+    return abs(local - remote) / max(abs(remote), 1e-12)
+
+
+def check(name, rtol):
+    bands_path, response_path = fixture_paths(name)
+    if not os.path.exists(bands_path):
+        raise SystemExit(f"no fixture {name!r} in {FIXTURES}, record one with --record")
+    with np.load(bands_path) as arrays:
+        bands = {band: arrays[band] for band in BANDS}
+    with open(response_path) as f:
+        fixture = json.load(f)
+    remote = remote_statistics(fixture["response"])
+    percentiles = fixture["percentiles"]
+    print(f"fixture {name}: {fixture['day']} over {fixture['aoi']}, {bands['dataMask'].shape[1]}x"
+          f"{bands['dataMask'].shape[0]} pixels")
+
+    # Largest relative error over all indices per ddof and per interpolation
+    stdev_errors = {}
+    percentile_errors = {}
+    counts_match = True
+    for ddof in DDOFS:
+        for method in PERCENTILE_METHODS:
+            local = scene_statistics(bands, INDICES, percentiles=percentiles,
+                                     cloud_cover_threshold=fixture["cloud_cover_threshold"],
+                                     ddof=ddof, percentile_method=method)
+            for index in INDICES:
+                stats = remote[index]
+                counts_match &= all(local[index][key] == stats[key] for key in ("sampleCount", "noDataCount"))
+                error = relative_error(local[index]["stDev"], stats["stDev"])
+                stdev_errors[ddof] = max(stdev_errors.get(ddof, 0.0), error)
+                for q in percentiles:
+                    key = str(float(q))
+                    error = relative_error(local[index]["percentiles"][key], stats["percentiles"][key])
+                    percentile_errors[method] = max(percentile_errors.get(method, 0.0), error)
+    mean_error = max(relative_error(local[index]["mean"], remote[index]["mean"]) for index in INDICES)
+
+    print(f"{'sample and no data counts':30} {'match' if counts_match else 'differ'}")
+    print(f"{'mean':30} {mean_error:.2e}")
+    for ddof, error in stdev_errors.items():
+        print(f"{f'stDev ddof={ddof}':30} {error:.2e}")
+    for method, error in percentile_errors.items():
+        print(f"{f'percentiles {method}':30} {error:.2e}")
+
+    ddof = min(stdev_errors, key=stdev_errors.get)
+    method = min(percentile_errors, key=percentile_errors.get)
+    print(f"closest to the Statistical API: ddof={ddof}, percentile method {method!r}")
+    settled = ddof == STDEV_DDOF and method == PERCENTILE_METHOD
+    within = max(mean_error, stdev_errors[ddof], percentile_errors[method]) <= rtol and counts_match
+    if not settled:
+        print(f"index_engine.py uses STDEV_DDOF = {STDEV_DDOF} and PERCENTILE_METHOD = {PERCENTILE_METHOD!r}")
+    if not within:
+        print(f"the closest match differs by more than {rtol:g}")
+    return settled and within
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the local index engine against the Statistical API")
+    parser.add_argument("--name", default="default", help="fixture name in benchmarks/fixtures")
+    parser.add_argument("--record", action="store_true", help="download a new fixture, needs Sentinel Hub secrets")
+    parser.add_argument("--day", default="2024-08-20", help="acquisition day to record")
+    parser.add_argument("--bbox", nargs=4, type=float, default=BBOX, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    parser.add_argument("--cloud-cover-threshold", type=float, default=CLOUD_COVER_THRESHOLD)
+    parser.add_argument("--rtol", type=float, default=1e-4, help="largest relative error accepted")
+    args = parser.parse_args()
+    if args.record:
+        record(args.name, args.bbox, args.day, args.cloud_cover_threshold)
+    sys.exit(0 if check(args.name, args.rtol) else 1)
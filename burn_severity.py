@@ -0,0 +1,159 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from batch_stats import MAX_AOI_WORKERS, load_aois
+from index_engine import dnbr, fetch_scene, windows
+from index_stats import aoi_kwargs, rate_limiter
+
+# dNBR burn severity between a pre-fire and a post-fire acquisition, classified with the
+# USGS thresholds (Key & Benson), and the burned area per class in hectares.
+
+SEVERITY_CLASSES = (
+    "Enhanced regrowth, high",
+    "Enhanced regrowth, low",
+    "Unburned",
+    "Low severity",
+    "Moderate-low severity",
+    "Moderate-high severity",
+    "High severity",
+)
+
+# Lower dNBR bound of every class after the first
+DNBR_BREAKS = np.array([-0.25, -0.1, 0.1, 0.27, 0.44, 0.66], dtype=np.float32)
+
+SEVERITY_COLORS = np.array([
+    (122, 135, 55), (172, 190, 77), (10, 224, 66), (255, 248, 8), (255, 175, 41), (255, 100, 27), (164, 31, 214),
+], dtype=np.uint8)
+
+# Classes that count as burned
+BURNED_CLASSES = SEVERITY_CLASSES[3:]
+
+NO_DATA = 255
+
+# Acquisitions offered for the pre- and post-fire scenes, scene cloud cover in percent
+MAX_SEVERITY_CLOUD_COVER = 20
+
+# Large AOIs are fetched in parts of at most this many pixels per side, so only one part
+# of the pre- and post-fire scenes is in memory at a time
+FETCH_TILE_PIXELS = 1024
+
+
+def classify_severity(dnbr_values):
+    # uint8 class codes indexing SEVERITY_CLASSES, NO_DATA where dNBR is undefined
+    classes = np.digitize(dnbr_values, DNBR_BREAKS).astype(np.uint8)
+    classes[~np.isfinite(dnbr_values)] = NO_DATA
+    return classes
+
+
+def class_counts(classes):
+    return np.bincount(classes[classes != NO_DATA], minlength=len(SEVERITY_CLASSES))
+
+
+def severity_image(classes):
+    # RGBA rendering of a class raster, transparent where there is no data
+    pixels = np.zeros(classes.shape + (4,), dtype=np.uint8)
+    valid = classes != NO_DATA
+    pixels[valid, :3] = SEVERITY_COLORS[classes[valid]]
+    pixels[valid, 3] = 255
+    return pixels
+
+
+def split_bbox(bbox, resolution, max_pixels=FETCH_TILE_PIXELS):
+    # Splits a (west, south, east, north) bbox into a grid of parts of at most max_pixels per side
+    from sentinelhub import BBox, CRS, bbox_to_dimensions
+
+    width, height = bbox_to_dimensions(BBox(bbox=list(bbox), crs=CRS.WGS84), resolution=resolution)
+    columns, rows = math.ceil(width / max_pixels), math.ceil(height / max_pixels)
+    west, south, east, north = bbox
+    step_x, step_y = (east - west) / columns, (north - south) / rows
+    return [
+        (west + column * step_x, south + row * step_y, west + (column + 1) * step_x, south + (row + 1) * step_y)
+        for row in range(rows)
+        for column in range(columns)
+    ]
+
+
+def aoi_bounds(aoi):
+    kwargs = aoi_kwargs(aoi)
+    bbox = kwargs["bbox"] if "bbox" in kwargs else kwargs["geometry"].bbox
+    return tuple(bbox)
+
+
+def fetch_scenes(aoi, pre_day, post_day, resolution, bbox=None):
+    scenes = []
+    for day in (pre_day, post_day):
+        rate_limiter.wait()
+        scenes.append(fetch_scene(aoi, day, resolution, bbox=bbox))
+    return scenes
+
+
+def severity_raster(aoi, pre_day, post_day, resolution=10):
+    # Class raster of the whole AOI in one piece, meant for display of small AOIs
+    pre, post = fetch_scenes(aoi, pre_day, post_day, resolution)
+    return classify_severity(dnbr(pre, post))
+
+
+def severity_counts(aoi, pre_day, post_day, resolution=10):
+    # Pixels per severity class, fetched part by part and classified window by window
+    counts = np.zeros(len(SEVERITY_CLASSES), dtype=np.int64)
+    for part in split_bbox(aoi_bounds(aoi), resolution):
+        pre, post = fetch_scenes(aoi, pre_day, post_day, resolution, bbox=part)
+        for window in windows(post["dataMask"].shape):
+            pre_tile = {band: array[window] for band, array in pre.items()}
+            post_tile = {band: array[window] for band, array in post.items()}
+            counts += class_counts(classify_severity(dnbr(pre_tile, post_tile)))
+    return counts
+
+
+def area_frame(aoi_id, counts, resolution):
+    # Pixel areas are approximated by the nominal resolution
+    return pd.DataFrame({
+        "aoi_id": aoi_id,
+        "severity": SEVERITY_CLASSES,
+        "pixels": counts,
+        "hectares": counts * resolution * resolution / 10000.0,
+    })
+
+
+def severity_table(aois, pre_day, post_day, resolution=10):
+    # Burned area per severity class for every AOI, one row per AOI and class.
+    # aois maps an AOI id to a (west, south, east, north) bbox or a GeoJSON geometry.
+    with ThreadPoolExecutor(max_workers=MAX_AOI_WORKERS) as pool:
+        futures = {
+            aoi_id: pool.submit(severity_counts, aoi, pre_day, post_day, resolution)
+            for aoi_id, aoi in aois.items()
+        }
+        frames = [area_frame(aoi_id, future.result(), resolution) for aoi_id, future in futures.items()]
+
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["aoi_id", "severity", "pixels", "hectares"])
+    df["aoi_id"] = df["aoi_id"].astype("category")
+    df["severity"] = pd.Categorical(df["severity"], categories=SEVERITY_CLASSES, ordered=True)
+    return df
+
+
+def burned_area(table):
+    # Hectares burned per AOI, summed over the burned severity classes
+    burned = table[table["severity"].isin(BURNED_CLASSES)]
+    return burned.groupby("aoi_id", observed=True)["hectares"].sum()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="dNBR burn severity area for all AOIs of a GeoJSON file")
+    parser.add_argument("aois", help="GeoJSON FeatureCollection with one polygon per AOI")
+    parser.add_argument("--pre", required=True, help="day of the pre-fire acquisition (YYYY-MM-DD)")
+    parser.add_argument("--post", required=True, help="day of the post-fire acquisition (YYYY-MM-DD)")
+    parser.add_argument("--resolution", type=float, default=10, help="pixel size in meters")
+    parser.add_argument("--output", required=True, help="output table, .parquet or .csv")
+    args = parser.parse_args()
+
+    df = severity_table(load_aois(args.aois), args.pre, args.post, args.resolution)
+    if args.output.endswith(".parquet"):
+        df.to_parquet(args.output, index=False)
+    else:
+        df.to_csv(args.output, index=False)
+    print(f"{burned_area(df).sum():.1f} ha burned over {df['aoi_id'].nunique()} AOIs, written to {args.output}")
@@ -0,0 +1,84 @@
+import math
+
+import numpy as np
+import plotly.graph_objects as go
+import streamlit as st
+
+# Plotting helpers for long index time series. Series are decimated with
+# Largest-Triangle-Three-Buckets (LTTB) to a point budget before they reach the browser,
+# and long ones are drawn with WebGL.
+
+# Points per series, in the order of the horizontal pixels of a wide chart
+MAX_POINTS = 1500
+
+# Series with more points than this are drawn with Scattergl
+WEBGL_THRESHOLD = 1000
+
+# Rows per page of the data tables
+PAGE_SIZE = 50
+
+
+def lttb(x, y, threshold):
+    # Indices of the points LTTB keeps out of (x, y): the first and the last point, and
+    # per bucket the one forming the largest triangle with its neighbours
+    count = len(y)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The next bucket is represented by its average point, the last one by the last point
+        next_start, next_end = (end, edges[bucket + 2]) if bucket + 2 < len(edges) else (count - 1, count)
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def decimate(df, x, y, max_points=MAX_POINTS):
+    # Rows of df kept by LTTB on the y column, all columns of a row are kept together
+    if max_points is None or len(df) <= max_points:
+        return df
+    x_values = df[x].to_numpy()
+    if np.issubdtype(x_values.dtype, np.datetime64):
+        x_values = x_values.astype("datetime64[ns]").astype(np.int64)
+    return df.iloc[lttb(x_values, df[y].to_numpy(), max_points)]
+
+
+def scatter_type(points):
+    return go.Scattergl if points > WEBGL_THRESHOLD else go.Scatter
+
+
+def add_series(fig, df, x, y, stdev=None, name=None, color=None, fillcolor=None, max_points=MAX_POINTS):
+    # Adds the y line over x, with a band of one standard deviation around it when a stdev
+    # column is given. The band is drawn between two lines instead of a closed polygon,
+    # so it does not double the points sent to the browser.
+    data = decimate(df, x, y, max_points)
+    scatter = scatter_type(len(data))
+    if stdev is not None:
+        fig.add_trace(scatter(
+            x=data[x], y=data[y] - data[stdev], mode='lines', line=dict(width=0), hoverinfo="skip", showlegend=False
+        ))
+        fig.add_trace(scatter(
+            x=data[x], y=data[y] + data[stdev], mode='lines', line=dict(width=0), fill='tonexty',
+            fillcolor=fillcolor, hoverinfo="skip", showlegend=False
+        ))
+    fig.add_trace(scatter(x=data[x], y=data[y], mode='lines', name=name or y, line=dict(color=color)))
+    return fig
+
+
+def paginated_table(df, page_size=PAGE_SIZE, key=None):
+    # Sends one page of rows to the browser instead of the whole frame
+    pages = max(1, math.ceil(len(df) / page_size))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+    st.dataframe(df.iloc[(page - 1) * page_size:page * page_size])
@@ -0,0 +1,171 @@
+import math
+import os
+from collections import namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+
+from index_engine import BANDS, INDEX_FUNCTIONS, STDEV_DDOF, compute_indices, valid_mask
+from index_stats import (
+    CLOUD_COVER_THRESHOLD, COLLECTION_ID, SETTLE_DAYS, TIME_INTERVAL, aoi_kwargs, get_stats_store, rate_limiter
+)
+from stats_store import series_key
+
+# Per-cell index statistics on a regular grid over the AOI. The raw bands of every
+# acquisition in the time range are fetched in one multi-temporal request, and the
+# statistics are kept as (time, row, col) float32 arrays per index.
+
+# Edge length of a grid cell in meters
+DEFAULT_CELL_SIZE = 200
+
+# Returns the raw bands of every orbit in the time range, one block of bands per orbit,
+# and the orbit dates as user data
+GRID_EVALSCRIPT = f"""
+//VERSION=3
+function setup() {{
+    return {{
+        input: [{{ bands: {list(BANDS)} }}],
+        output: [
+            {{ id: "default", bands: {len(BANDS)}, sampleType: "FLOAT32" }}
+        ],
+        mosaicking: "ORBIT"
+    }};
+}}
+
+function updateOutput(outputs, collection) {{
+    outputs.default.bands = collection.scenes.length * {len(BANDS)};
+}}
+
+function updateOutputMetadata(scenes, inputMetadata, outputMetadata) {{
+    outputMetadata.userData = {{ dates: scenes.orbits.map((orbit) => orbit.dateFrom) }};
+}}
+
+function evaluatePixel(samples) {{
+    let values = [];
+    for (const sample of samples) {{
+        values.push(sample.B04, sample.B08, sample.B12, sample.CLM, sample.dataMask);
+    }}
+    return values;
+}}
+"""
+
+# dates are datetime64[D], mean and stdev map an index name to a (time, row, col) float32
+# array and coverage is the share of valid pixels of every cell
+GridStatistics = namedtuple("GridStatistics", ["dates", "bounds", "cell_size", "mean", "stdev", "coverage"])
+
+
+def fetch_time_series(aoi, time_interval, resolution=10):
+    # Raw bands of all acquisitions as a dict of (time, height, width) arrays, and their dates
+    from sentinelhub import SentinelHubRequest, DataCollection, MimeType, bbox_to_dimensions
+    from sh_client import get_sentinel_hub_client
+
+    kwargs = aoi_kwargs(aoi)
+    bbox = kwargs["bbox"] if "bbox" in kwargs else kwargs["geometry"].bbox
+    client = get_sentinel_hub_client()
+    request = SentinelHubRequest(
+        evalscript=GRID_EVALSCRIPT,
+        input_data=[
+            SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=time_interval)
+        ],
+        responses=[
+            SentinelHubRequest.output_response("default", MimeType.TIFF),
+            SentinelHubRequest.output_response("userdata", MimeType.JSON),
+        ],
+        size=bbox_to_dimensions(bbox, resolution=resolution),
+        config=client.config,
+        **kwargs
+    )
+    rate_limiter.wait()
+    data = client.get_data(request)[0]
+    dates = np.array([day[:10] for day in data["userdata.json"]["dates"]], dtype="datetime64[D]")
+    pixels = data["default.tif"].reshape(data["default.tif"].shape[:2] + (len(dates), len(BANDS)))
+    # Orbits come most recent first
+    order = np.argsort(dates, kind="stable")
+    bands = {band: np.moveaxis(pixels[..., order, i], -1, 0).astype(np.float32) for i, band in enumerate(BANDS)}
+    return dates[order], bands
+
+
+def cell_statistics(values, cell_pixels):
+    # Mean, standard deviation and valid pixel count of every cell of (time, height, width)
+    # values, NaN marks invalid pixels. Edge cells are padded with NaN.
+    steps, height, width = values.shape
+    rows, cols = math.ceil(height / cell_pixels), math.ceil(width / cell_pixels)
+    padded = np.full((steps, rows * cell_pixels, cols * cell_pixels), np.nan, dtype=np.float32)
+    padded[:, :height, :width] = values
+    cells = padded.reshape(steps, rows, cell_pixels, cols, cell_pixels)
+    count = np.isfinite(cells).sum(axis=(2, 4))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(cells, axis=(2, 4)) / count
+        squares = np.nansum(np.square(cells - mean[:, :, None, :, None]), axis=(2, 4))
+        stdev = np.sqrt(squares / (count - STDEV_DDOF))
+    stdev[count <= STDEV_DDOF] = np.nan
+    return mean.astype(np.float32), stdev.astype(np.float32), count
+
+
+def grid_from_bands(dates, bands, bounds, cell_size, resolution, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    cell_pixels = max(1, round(cell_size / resolution))
+    indices = compute_indices(bands, tuple(INDEX_FUNCTIONS), cloud_cover_threshold)
+    valid = np.where(valid_mask(bands, cloud_cover_threshold), 1.0, np.nan).astype(np.float32)
+    _, _, valid_count = cell_statistics(valid, cell_pixels)
+    coverage = (valid_count / cell_pixels ** 2).astype(np.float32)
+    # Acquisitions without a single valid pixel, e.g. fully clouded, are left out
+    keep = valid_count.reshape(len(dates), -1).any(axis=1)
+    mean, stdev = {}, {}
+    for name, values in indices.items():
+        mean[name], stdev[name], _ = cell_statistics(values[keep], cell_pixels)
+    return GridStatistics(dates[keep], tuple(bounds), cell_size, mean, stdev, coverage[keep])
+
+
+def save_grid(path, grid):
+    arrays = {f"mean_{name}": values for name, values in grid.mean.items()}
+    arrays.update({f"stdev_{name}": values for name, values in grid.stdev.items()})
+    # Written to a temporary file first, so other processes never load a partial grid
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        np.savez_compressed(
+            f, dates=grid.dates, bounds=np.array(grid.bounds), cell_size=grid.cell_size, coverage=grid.coverage, **arrays
+        )
+    os.replace(temporary, path)
+
+
+def load_grid(path):
+    with np.load(path) as data:
+        names = [key[len("mean_"):] for key in data.files if key.startswith("mean_")]
+        return GridStatistics(
+            data["dates"], tuple(data["bounds"].tolist()), data["cell_size"].item(),
+            {name: data[f"mean_{name}"] for name in names},
+            {name: data[f"stdev_{name}"] for name in names},
+            data["coverage"],
+        )
+
+
+def grid_statistics(aoi, time_interval=TIME_INTERVAL, cell_size=DEFAULT_CELL_SIZE, resolution=10,
+                    cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    # Grids of time ranges that ended more than SETTLE_DAYS ago do not change anymore, they
+    # are kept next to the statistics cache, under its size budget and TTL, and reused
+    store = get_stats_store()
+    key = series_key(
+        [GRID_EVALSCRIPT, list(time_interval), cell_size, resolution, cloud_cover_threshold],
+        aoi,
+        COLLECTION_ID,
+    )
+    path = store.get_file(key)
+    if path is not None:
+        try:
+            return load_grid(path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            pass
+
+    dates, bands = fetch_time_series(aoi, time_interval, resolution)
+    kwargs = aoi_kwargs(aoi)
+    bounds = tuple(kwargs["bbox"] if "bbox" in kwargs else kwargs["geometry"].bbox)
+    grid = grid_from_bands(dates, bands, bounds, cell_size, resolution, cloud_cover_threshold)
+
+    settled = date.today() - timedelta(days=SETTLE_DAYS)
+    if time_interval[1] and date.fromisoformat(time_interval[1][:10]) <= settled:
+        path = os.path.join(os.path.dirname(os.path.abspath(store.path)), "grids", f"{key}.npz")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_grid(path, grid)
+        store.put_file(key, path)
+    return grid
@@ -0,0 +1,177 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+from index_stats import CLOUD_COVER_THRESHOLD, aoi_kwargs
+
+# Local index computation. The raw bands of a scene are downloaded once and every index
+# is computed from them with NumPy, so adding an index costs no extra remote request.
+# Bands are handled as a dict of 2D float32 arrays keyed by band name, and statistics
+# use the layout of the Statistical API (mean, stDev, sampleCount, noDataCount, ...).
+
+BANDS = ("B04", "B08", "B12", "CLM", "dataMask")
+
+# Edge length of the windows the indices are computed in, bounds the intermediate arrays
+TILE_SIZE = 512
+
+# Degrees of freedom of the standard deviation
+STDEV_DDOF = 1
+
+# Percentile interpolation, "higher" is the default of the Statistical API
+PERCENTILE_METHOD = "higher"
+
+RAW_EVALSCRIPT = f"""
+//VERSION=3
+function setup() {{
+    return {{
+        input: {list(BANDS)},
+        output: {{ bands: {len(BANDS)}, sampleType: "FLOAT32" }}
+    }};
+}}
+
+function evaluatePixel(sample) {{
+    return [sample.B04, sample.B08, sample.B12, sample.CLM, sample.dataMask];
+}}
+"""
+
+
+def normalized_difference(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (a - b) / (a + b)
+
+
+def ndvi(bands):
+    return normalized_difference(bands["B08"], bands["B04"])
+
+
+def nbr(bands):
+    return normalized_difference(bands["B08"], bands["B12"])
+
+
+def bai(bands):
+    with np.errstate(divide="ignore"):
+        return 1 / (np.square(bands["B08"] - 0.06) + np.square(bands["B04"] - 0.1))
+
+
+# Single-scene indices, the formulas of the index evalscripts
+INDEX_FUNCTIONS = {"NDVI": ndvi, "NBR": nbr, "BAI": bai}
+
+
+def valid_mask(bands, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    # Pixels with data that are not masked as cloud
+    return (bands["dataMask"] > 0) & (bands["CLM"] <= cloud_cover_threshold)
+
+
+def compute_indices(bands, names=tuple(INDEX_FUNCTIONS), cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    # float32 index arrays with NaN wherever the pixel is invalid or the index undefined
+    valid = valid_mask(bands, cloud_cover_threshold)
+    indices = {}
+    for name in names:
+        values = INDEX_FUNCTIONS[name](bands).astype(np.float32)
+        values[~(valid & np.isfinite(values))] = np.nan
+        indices[name] = values
+    return indices
+
+
+def dnbr(pre_bands, post_bands, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    # Differenced NBR between a pre-fire and a post-fire scene, NaN unless both are valid
+    pre = compute_indices(pre_bands, ("NBR",), cloud_cover_threshold)["NBR"]
+    post = compute_indices(post_bands, ("NBR",), cloud_cover_threshold)["NBR"]
+    return pre - post
+
+
+class RunningStats:
+    # Mean, variance, min and max merged tile by tile (Chan et al.), so only the current
+    # tile is held in memory. Values are kept for the percentiles only when asked for.
+
+    def __init__(self, keep_values=False):
+        self.count = 0
+        self.no_data = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.values = [] if keep_values else None
+
+    def add(self, values):
+        valid = values[np.isfinite(values)].astype(np.float64)
+        self.no_data += values.size - valid.size
+        if valid.size == 0:
+            return
+        mean = valid.mean()
+        m2 = np.square(valid - mean).sum()
+        count = self.count + valid.size
+        delta = mean - self.mean
+        self.mean += delta * valid.size / count
+        self.m2 += m2 + delta * delta * self.count * valid.size / count
+        self.count = count
+        self.min = min(self.min, valid.min())
+        self.max = max(self.max, valid.max())
+        if self.values is not None:
+            self.values.append(valid.astype(np.float32))
+
+    def result(self, percentiles=(), ddof=STDEV_DDOF, percentile_method=PERCENTILE_METHOD):
+        stats = {"sampleCount": self.count + self.no_data, "noDataCount": self.no_data}
+        if self.count == 0:
+            stats.update({"min": "NaN", "max": "NaN", "mean": "NaN", "stDev": "NaN"})
+            return stats
+        stdev = np.sqrt(self.m2 / (self.count - ddof)) if self.count > ddof else 0.0
+        stats.update({"min": float(self.min), "max": float(self.max), "mean": float(self.mean), "stDev": float(stdev)})
+        if percentiles:
+            values = np.concatenate(self.values)
+            stats["percentiles"] = {str(float(q)): float(np.percentile(values, q, method=percentile_method))
+                                   for q in percentiles}
+        return stats
+
+
+def windows(shape, tile_size=TILE_SIZE):
+    for row in range(0, shape[0], tile_size):
+        for col in range(0, shape[1], tile_size):
+            yield np.s_[row:row + tile_size, col:col + tile_size]
+
+
+def scene_statistics(bands, names=tuple(INDEX_FUNCTIONS), pre_bands=None, percentiles=(),
+                     cloud_cover_threshold=CLOUD_COVER_THRESHOLD, tile_size=TILE_SIZE, ddof=STDEV_DDOF,
+                     percentile_method=PERCENTILE_METHOD):
+    # Masked statistics of every index over a scene, computed window by window. With the
+    # bands of a pre-fire scene, dNBR is added as well.
+    accumulators = {name: RunningStats(bool(percentiles)) for name in names}
+    if pre_bands is not None:
+        accumulators["dNBR"] = RunningStats(bool(percentiles))
+    for window in windows(bands["dataMask"].shape, tile_size):
+        tile = {band: array[window] for band, array in bands.items()}
+        for name, values in compute_indices(tile, names, cloud_cover_threshold).items():
+            accumulators[name].add(values)
+        if pre_bands is not None:
+            pre_tile = {band: array[window] for band, array in pre_bands.items()}
+            accumulators["dNBR"].add(dnbr(pre_tile, tile, cloud_cover_threshold))
+    return {name: accumulator.result(percentiles, ddof, percentile_method) for name, accumulator in accumulators.items()}
+
+
+def fetch_scene(aoi, day, resolution=10, bbox=None):
+    # Raw bands of the Sentinel-2 L2A acquisition of one day over the AOI, in a single request.
+    # A (west, south, east, north) bbox limits the request to that part of the AOI.
+    from sentinelhub import SentinelHubRequest, DataCollection, MimeType, BBox, CRS, bbox_to_dimensions
+    from sh_client import get_sentinel_hub_client
+
+    kwargs = aoi_kwargs(aoi)
+    if bbox is not None:
+        kwargs["bbox"] = BBox(bbox=list(bbox), crs=CRS.WGS84)
+    bbox = kwargs["bbox"] if "bbox" in kwargs else kwargs["geometry"].bbox
+    next_day = (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+    client = get_sentinel_hub_client()
+    request = SentinelHubRequest(
+        evalscript=RAW_EVALSCRIPT,
+        input_data=[
+            SentinelHubRequest.input_data(
+                data_collection=DataCollection.SENTINEL2_L2A,
+                time_interval=(f"{day}T00:00:00Z", f"{next_day}T00:00:00Z"),
+            )
+        ],
+        responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
+        size=bbox_to_dimensions(bbox, resolution=resolution),
+        config=client.config,
+        **kwargs
+    )
+    pixels = client.get_data(request)[0]
+    return {band: np.ascontiguousarray(pixels[..., i], dtype=np.float32) for i, band in enumerate(BANDS)}
@@ -0,0 +1,415 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from operator import itemgetter
+
+import numpy as np
+import streamlit as st
+import pandas as pd
+
+from preload import start_preload
+from stats_store import StatsStore, catalog_key, request_key, series_key
+
+# Shared Statistical API access for the index pages. A single multi-band evalscript
+# returns NDVI, NBR and BAI together, so all pages share one cached remote aggregation.
+
+# Define the area of interest and time range
+BBOX = (-63.157139, -14.375157, -63.145466, -14.365157)
+TIME_INTERVAL = ('2024-03-31T00:00:00Z', '2024-11-20T00:00:00Z')
+
+# Define the cloud cover threshold (e.g., 50%)
+CLOUD_COVER_THRESHOLD = 0.1
+
+# Days younger than this are fetched again, Sentinel Hub may still ingest new scenes for them
+SETTLE_DAYS = 3
+
+# Acquisitions whose whole scene is more clouded than this (percent) are not requested,
+# the per-pixel cloud mask above still applies to the others
+MAX_SCENE_CLOUD_COVER = 100
+
+# Acquisition lists and coarse statistics that include recent days are looked up again
+# after this many seconds
+RECENT_TTL = 3600
+
+# Aggregation interval of the preview the index pages draw before the daily values arrive
+COARSE_INTERVAL = "P10D"
+
+# Seconds between two refinements of the preview while daily chunks arrive
+REFINE_SECONDS = 1.0
+
+# Long time ranges are fetched in chunks of this many days, a few chunks at a time
+CHUNK_DAYS = 30
+
+# Acquisition days separated by at most this many days without one share a request
+MAX_GAP_DAYS = 10
+MAX_WORKERS = 4
+CHUNK_RETRIES = 3
+REQUESTS_PER_SECOND = 5
+
+# Output bands of the evalscript, in order
+INDICES = ("NDVI", "NBR", "BAI")
+
+# api_id of DataCollection.SENTINEL2_L2A, sentinelhub is only imported once a request is sent
+COLLECTION_ID = "sentinel-2-l2a"
+
+# Index pages opened directly, without the landing page, start the preload as well
+start_preload()
+
+
+# One persistent response store per process, shared by all sessions and pages
+@st.cache_resource
+def get_stats_store():
+    settings = st.secrets.get("stats_cache", {})
+    return StatsStore(
+        path=settings.get("path", ".stats_cache/statistics.db"),
+        max_bytes=int(settings.get("max_mb", 256)) * 1024 * 1024,
+        ttl=int(settings.get("ttl", 7 * 24 * 3600)),
+    )
+
+
+def build_evalscript(cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    # Evalscript for all indices with cloud cover filter
+    return f"""
+    //VERSION=3
+    function setup() {{
+        return {{
+            input: ["B08", "B04", "B12", "CLM", "dataMask"],
+            output: [
+                {{ id: "default", bands: {len(INDICES)} }},
+                {{ id: "dataMask", bands: 1 }}
+            ]
+        }};
+    }}
+
+    function evaluatePixel(sample) {{
+        // Cloud mask: exclude pixels with cloud cover greater than the threshold
+        if (sample.CLM > {cloud_cover_threshold}) {{
+            return {{ default: [null, null, null], dataMask: [0] }};
+        }}
+        let ndvi = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
+        let nbr = (sample.B08 - sample.B12) / (sample.B08 + sample.B12);
+        let bai = 1 / (Math.pow((sample.B08 - 0.06), 2) + Math.pow((sample.B04 - 0.1), 2));
+        return {{ default: [ndvi, nbr, bai], dataMask: [sample.dataMask] }};
+    }}
+    """
+
+
+def aoi_kwargs(aoi):
+    # An AOI is either a (west, south, east, north) bbox or a GeoJSON geometry, both in WGS84
+    from sentinelhub import BBox, CRS, Geometry
+
+    if isinstance(aoi, dict):
+        return {"geometry": Geometry(aoi, crs=CRS.WGS84)}
+    return {"bbox": BBox(bbox=list(aoi), crs=CRS.WGS84)}
+
+
+def fetch_statistics(aoi, time_interval, evalscript, aggregation_interval="P1D"):
+    # Run one Statistical API request and return its response
+    from sentinelhub import SentinelHubStatistical
+    from sh_client import get_sentinel_hub_client
+
+    client = get_sentinel_hub_client()
+    request = SentinelHubStatistical(
+        aggregation={
+            "timeRange": {
+                "from": time_interval[0],
+                "to": time_interval[1]
+            },
+            "aggregationInterval": {
+                "of": aggregation_interval,
+                "lastIntervalBehavior": "SHORTEN"
+            },
+            "evalscript": evalscript
+        },
+        input_data=[
+            {
+                "type": COLLECTION_ID,
+                "dataFilter": {
+                    "timeRange": {
+                        "from": time_interval[0],
+                        "to": time_interval[1]
+                    }
+                }
+            }
+        ],
+        config=client.config,
+        **aoi_kwargs(aoi)
+    )
+    return client.get_data(request)
+
+
+def day_range(time_interval):
+    # Days covered by a time interval, the end is exclusive. An end of None means today.
+    start = date.fromisoformat(time_interval[0][:10])
+    end = date.fromisoformat(time_interval[1][:10]) if time_interval[1] else date.today() + timedelta(days=1)
+    return [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days)]
+
+
+def missing_ranges(days, materialized):
+    # Groups the days that are not materialized yet into contiguous [from, to) intervals
+    ranges = []
+    for day in days:
+        if day in materialized:
+            continue
+        day_end = (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day_end
+        else:
+            ranges.append([day, day_end])
+    return [(f"{start}T00:00:00Z", f"{end}T00:00:00Z") for start, end in ranges]
+
+
+def request_spans(days, max_gap_days=MAX_GAP_DAYS, chunk_days=CHUNK_DAYS):
+    # Groups sorted days into [from, to) intervals of at most chunk_days days. A day joins
+    # the current interval while at most max_gap_days days lie between it and the last one.
+    spans = []
+    for day in days:
+        current = date.fromisoformat(day)
+        if spans and (current - spans[-1][1]).days - 1 <= max_gap_days and (current - spans[-1][0]).days < chunk_days:
+            spans[-1][1] = current
+        else:
+            spans.append([current, current])
+    return [(f"{start}T00:00:00Z", f"{end + timedelta(days=1)}T00:00:00Z") for start, end in spans]
+
+
+class RateLimiter:
+    # Spaces out request starts so that at most `rate` requests per second are sent
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(start - now)
+
+
+# Shared by all sessions of the process, Sentinel Hub rate limits are per account
+rate_limiter = RateLimiter(REQUESTS_PER_SECOND)
+
+
+def fetch_chunk(aoi, time_range, evalscript):
+    # A failed chunk is retried on its own with exponential backoff
+    from sentinelhub.exceptions import DownloadFailedException
+
+    for attempt in range(CHUNK_RETRIES):
+        rate_limiter.wait()
+        try:
+            return fetch_statistics(aoi, time_range, evalscript)
+        except DownloadFailedException:
+            if attempt == CHUNK_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def is_recent(time_range):
+    # New scenes can still be ingested for ranges that end within the last SETTLE_DAYS days
+    return date.fromisoformat(time_range[1][:10]) > date.today() - timedelta(days=SETTLE_DAYS)
+
+
+def acquisition_dates(store, aoi, time_range):
+    # Days with a Sentinel-2 L2A acquisition over the AOI, mapped to the lowest scene cloud
+    # cover of the day. Catalog results are kept in the response store.
+    key = catalog_key(aoi, time_range, COLLECTION_ID)
+    dates = store.get(key)
+    if dates is None:
+        from sentinelhub import DataCollection
+        from sh_client import get_sentinel_hub_client
+
+        rate_limiter.wait()
+        features = get_sentinel_hub_client().catalog().search(
+            DataCollection.SENTINEL2_L2A,
+            time=time_range,
+            fields={"include": ["properties.datetime", "properties.eo:cloud_cover"], "exclude": []},
+            **aoi_kwargs(aoi)
+        )
+        dates = {}
+        for feature in features:
+            day = feature["properties"]["datetime"][:10]
+            cloud_cover = feature["properties"].get("eo:cloud_cover", 0)
+            dates[day] = min(cloud_cover, dates.get(day, cloud_cover))
+        store.put(key, dates, ttl=RECENT_TTL if is_recent(time_range) else None)
+    return dates
+
+
+def daily_updates(store, series, aoi, evalscript, days):
+    # Fetch only the days of the series that are not materialized in the store yet, and of
+    # those only the spans with acquisitions. Days without one are stored as empty right
+    # away. The spans are fetched concurrently on a bounded pool.
+    # Yields the set of materialized days and the days stored since the last yield, mapped
+    # to their interval or None without data, once before and again after every stored chunk.
+    materialized = store.settled_days(series, days[0], days[-1], SETTLE_DAYS)
+    stored = {}
+    chunks = []
+    for time_range in missing_ranges(days, materialized):
+        range_days = day_range(time_range)
+        acquired = {
+            day for day, cloud_cover in acquisition_dates(store, aoi, time_range).items()
+            if cloud_cover <= MAX_SCENE_CLOUD_COVER
+        }
+        empty = [day for day in range_days if day not in acquired]
+        store.put_days(series, empty, {})
+        materialized.update(empty)
+        stored.update(dict.fromkeys(empty))
+        # Nearby acquisitions share a request, the empty days between them come back empty
+        chunks.extend(request_spans([day for day in range_days if day in acquired]))
+    yield materialized, stored
+    if not chunks:
+        return
+    from sentinelhub.exceptions import DownloadFailedException
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(chunks))) as pool:
+        futures = {pool.submit(fetch_chunk, aoi, chunk, evalscript): chunk for chunk in chunks}
+        # Store every chunk that succeeded before reporting a failed one, so a retry only
+        # has to fetch the failed chunks
+        failed = None
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+            except DownloadFailedException as error:
+                failed = error
+                continue
+            intervals = {interval['interval']['from'][:10]: interval for interval in response[0]['data']}
+            chunk_days = day_range(futures[future])
+            store.put_days(series, chunk_days, intervals)
+            materialized.update(chunk_days)
+            yield materialized, {day: intervals.get(day) for day in chunk_days}
+        if failed is not None:
+            raise failed
+
+
+def update_daily_series(store, series, aoi, evalscript, days):
+    for _ in daily_updates(store, series, aoi, evalscript, days):
+        pass
+
+
+# Fetch the daily statistics of all indices and cache the response for every page.
+# Days are materialized on disk per AOI and evalscript, so a request only fetches the
+# days that were never fetched before and restarts or other replicas reuse them.
+# The in-memory copy expires hourly so that recent days get refreshed.
+@st.cache_data(ttl=3600)
+def get_index_statistics(bbox=BBOX, time_interval=TIME_INTERVAL, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    return daily_statistics(bbox, time_interval, cloud_cover_threshold)
+
+
+def daily_statistics(aoi, time_interval=TIME_INTERVAL, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    evalscript = build_evalscript(cloud_cover_threshold)
+    store = get_stats_store()
+    series = series_key(evalscript, aoi, COLLECTION_ID)
+    days = day_range(time_interval)
+    if not days:
+        return [{'data': []}]
+    update_daily_series(store, series, aoi, evalscript, days)
+    return [{'data': store.get_days(series, days[0], days[-1])}]
+
+
+# A single cheap request at COARSE_INTERVAL resolution, kept in the response store
+@st.cache_data(ttl=3600)
+def get_coarse_statistics(bbox=BBOX, time_interval=TIME_INTERVAL, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    return coarse_statistics(bbox, time_interval, cloud_cover_threshold)
+
+
+def coarse_statistics(aoi, time_interval=TIME_INTERVAL, cloud_cover_threshold=CLOUD_COVER_THRESHOLD,
+                      aggregation_interval=COARSE_INTERVAL):
+    if time_interval[1] is None:
+        time_interval = (time_interval[0], f"{date.today() + timedelta(days=1)}T00:00:00Z")
+    evalscript = build_evalscript(cloud_cover_threshold)
+    store = get_stats_store()
+    key = request_key(evalscript, aoi, time_interval, COLLECTION_ID, aggregation_interval)
+    response = store.get(key)
+    if response is None:
+        rate_limiter.wait()
+        response = fetch_statistics(aoi, time_interval, evalscript, aggregation_interval)
+        store.put(key, response, ttl=RECENT_TTL if is_recent(time_interval) else None)
+    return response
+
+
+def progressive_statistics(bbox=BBOX, time_interval=TIME_INTERVAL, cloud_cover_threshold=CLOUD_COVER_THRESHOLD):
+    # Yields (response, complete) pairs of increasing resolution, so the pages can draw a
+    # chart right away and refine it. Series that were fetched before come complete at
+    # once. Otherwise the coarse aggregation comes first, then the daily values at most
+    # every REFINE_SECONDS as chunks land, with coarse intervals filling the days that are
+    # still missing. The store is read once, new chunks are merged in memory.
+    evalscript = build_evalscript(cloud_cover_threshold)
+    store = get_stats_store()
+    series = series_key(evalscript, bbox, COLLECTION_ID)
+    days = day_range(time_interval)
+    if not days or len(store.fetched_days(series, days[0], days[-1])) == len(days):
+        yield get_index_statistics(bbox, time_interval, cloud_cover_threshold), True
+        return
+
+    coarse = get_coarse_statistics(bbox, time_interval, cloud_cover_threshold)
+    yield coarse, False
+    refined = time.monotonic()
+    daily = {interval['interval']['from'][:10]: interval for interval in store.get_days(series, days[0], days[-1])}
+    for materialized, stored in daily_updates(store, series, bbox, evalscript, days):
+        for day, interval in stored.items():
+            if interval is None:
+                daily.pop(day, None)
+            else:
+                daily[day] = interval
+        if time.monotonic() - refined < REFINE_SECONDS:
+            continue
+        pending = [
+            interval for interval in coarse[0]['data']
+            if not materialized.issuperset(day_range((interval['interval']['from'], interval['interval']['to'])))
+        ]
+        yield [{'data': sorted(list(daily.values()) + pending, key=lambda interval: interval['interval']['from'])}], False
+        refined = time.monotonic()
+    yield [{'data': [daily[day] for day in sorted(daily)]}], True
+
+
+def statistics_arrays(response, band_names=INDICES, stats=("mean", "stDev"), date_field="to", output="default",
+                      dtype=np.float32):
+    # Parses a Statistical API response in a single pass into the interval dates
+    # (datetime64) and an array of shape (intervals, bands, stats), float32 by default.
+    # Intervals without the output, e.g. no valid pixels, stay NaN.
+    data = response[0]['data']
+    band_keys = [f"B{band}" for band in range(len(band_names))]
+    pick = itemgetter(*stats) if len(stats) > 1 else lambda values: (values[stats[0]],)
+    present = []
+    flat = []
+    for position, interval in enumerate(data):
+        outputs = interval['outputs'].get(output)
+        if outputs is None:
+            continue
+        present.append(position)
+        bands = outputs['bands']
+        for key in band_keys:
+            flat.extend(pick(bands[key]['stats']))
+
+    values = np.full((len(data), len(band_keys), len(stats)), np.nan, dtype=dtype)
+    if present:
+        # NumPy converts the "NaN" strings of empty statistics to NaN
+        values[present] = np.array(flat, dtype=dtype).reshape(len(present), len(band_keys), len(stats))
+    dates = np.array([interval['interval'][date_field][:19] for interval in data], dtype='datetime64[s]')
+    return dates, values
+
+
+def parse_statistics(response, band_names=INDICES):
+    # Compact typed frame: a datetime64 'Date' index and float32 mean and StdDev columns per band
+    dates, values = statistics_arrays(response, band_names)
+    columns = {}
+    for band, name in enumerate(band_names):
+        columns[name] = values[:, band, 0]
+        columns[f"{name}_StdDev"] = values[:, band, 1]
+    return pd.DataFrame(columns, index=pd.DatetimeIndex(dates, name='Date'))
+
+
+def statistics_frame(response):
+    # One row per interval with the mean and standard deviation of every index, and the
+    # interval end as 'Date' column
+    return parse_statistics(response).reset_index()
+
+
+def index_frame(response, index, column=None):
+    # Typed view of a single index: Date, the index mean (named `column`) and StdDev,
+    # without the intervals where the index has no value
+    df = statistics_frame(response)[['Date', index, f"{index}_StdDev"]]
+    df = df.rename(columns={index: column or index, f"{index}_StdDev": 'StdDev'})
+    return df.dropna().reset_index(drop=True)
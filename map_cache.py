@@ -0,0 +1,94 @@
+import json
+from collections import namedtuple
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+from preload import start_preload
+
+# Map pages render through here. The map is built and serialized to HTML once per
+# (center, zoom, layers) and the HTML is reused by every rerun. Opacity and visibility
+# are changed in the browser, with an opacity slider inside the map and the layer
+# control, so they neither rerun the script nor change the HTML that is sent.
+
+# A tile layer of a map. Layers with opacity_control get a slider in the map.
+Layer = namedtuple("Layer", ["name", "url", "attribution", "shown", "opacity", "opacity_control"],
+                   defaults=(True, 1.0, False))
+
+# Built maps kept per process, e.g. one per swipe position
+MAX_MAPS = 64
+
+# Map pages opened directly, without the landing page, start the preload as well
+start_preload()
+
+OPACITY_CONTROL = """
+<script>
+(function () {{
+    var map = {map};
+    var layers = {layers};
+    var control = L.control({{position: "bottomleft"}});
+    control.onAdd = function () {{
+        var div = L.DomUtil.create("div", "leaflet-bar");
+        div.style.background = "white";
+        div.style.padding = "6px 10px";
+        layers.forEach(function (item) {{
+            var label = L.DomUtil.create("label", "", div);
+            label.style.display = "block";
+            label.textContent = item.name + " opacity";
+            var input = L.DomUtil.create("input", "", label);
+            input.type = "range";
+            input.min = 0;
+            input.max = 1;
+            input.step = 0.01;
+            input.value = item.layer.options.opacity;
+            input.style.display = "block";
+            input.addEventListener("input", function () {{
+                item.layer.setOpacity(parseFloat(input.value));
+            }});
+        }});
+        L.DomEvent.disableClickPropagation(div);
+        L.DomEvent.disableScrollPropagation(div);
+        return div;
+    }};
+    control.addTo(map);
+}})();
+</script>
+"""
+
+
+@st.cache_data(persist="disk", max_entries=MAX_MAPS)
+def map_html(center, zoom, layers):
+    # leafmap is only needed to build a map that is not cached yet
+    import folium
+    import leafmap.foliumap as leafmap
+
+    m = leafmap.Map(center=list(center), zoom=zoom)
+    for layer in layers:
+        m.add_tile_layer(
+            url=layer.url, name=layer.name, attribution=layer.attribution, shown=layer.shown, opacity=layer.opacity
+        )
+    m.add_layer_control()
+    html = m.to_html()
+
+    # The JavaScript variables folium gave the layers, to reach them from the control
+    variables = {
+        child.layer_name: child.get_name()
+        for child in m._children.values() if isinstance(child, folium.TileLayer)
+    }
+    controlled = [layer.name for layer in layers if layer.opacity_control]
+    if not controlled:
+        return html
+    entries = ", ".join(f"{{name: {json.dumps(name)}, layer: {variables[name]}}}" for name in controlled)
+    script = OPACITY_CONTROL.format(map=m.get_name(), layers=f"[{entries}]")
+    # folium emits the map script after the body, the control has to run after it
+    head, end, tail = html.rpartition("</html>")
+    return head + script + end + tail
+
+
+def show_map(center, zoom, layers, height=700):
+    html = map_html(tuple(center), zoom, tuple(layers))
+    # st.iframe replaces components.html in recent Streamlit versions
+    if hasattr(st, "iframe"):
+        st.iframe(html, height=height)
+    else:
+        components.html(html, height=height)
@@ -1,17 +1,5 @@
 import streamlit as st
-import leafmap.foliumap as leafmap
-import subprocess
-import os
-import atexit
-
-# Start the proxy server as a background process
-# proxy_process = subprocess.Popen(['python', 'proxy_server.py'])
-
-# Ensure the proxy server is terminated when the app is closed
-# def stop_proxy():
-#     proxy_process.terminate()
-
-# atexit.register(stop_proxy)
+from map_cache import Layer, show_map
 
 st.set_page_config(layout="wide")
 
@@ -27,27 +15,51 @@ st.sidebar.image(logo)
 
 st.title("Before and after event with PS Basemaps")
 
-# Add sliders for opacity
-#opacity_before = st.sidebar.slider("Select opacity for the 'Before event' basemap", 0.0001, 1.0, 0.5)
-opacity_after = st.sidebar.slider("Select opacity for the 'After event' basemap", 0.0001, 1.0, 0.0)
+# Opacity is set with the slider inside the map and the burn scars are switched in the layer
+# control, both in the browser, so only the display mode changes the map
+display_mode = st.sidebar.radio("Display", ["Fade", "Swipe", "Difference"])
+if display_mode == "Swipe":
+    swipe_longitude = st.sidebar.slider("Swipe longitude", -63.5, -62.7, -63.11)
+
+#proxy_url = "http://localhost:5000"
+proxy_url = "https://reverse-proxy-basemaps.onrender.com"
+before_mosaic = "global_monthly_2024_08_mosaic"
+after_mosaic = "global_monthly_2024_10_mosaic"
 
 with st.expander("See source code"):
     with st.echo():
-        m = leafmap.Map(center=[-14.2, -63.11], zoom=10)
-        m.add_tile_layer(
-            #url="http://localhost:5000/tiles/global_monthly_2024_08_mosaic/gmap/{z}/{x}/{y}.png",
-            url="https://reverse-proxy-basemaps.onrender.com/tiles/global_monthly_2024_08_mosaic/gmap/{z}/{x}/{y}.png",
-            name="Before event",
-            #opacity=opacity_before,
-            attribution="© Planet Labs"
-        )
-        m.add_tile_layer(
-            #url="http://localhost:5000/tiles/global_monthly_2024_10_mosaic/gmap/{z}/{x}/{y}.png",
-            url="https://reverse-proxy-basemaps.onrender.com/tiles/global_monthly_2024_10_mosaic/gmap/{z}/{x}/{y}.png",
-            name="After event",
-            opacity=opacity_after,
-            attribution="© Planet Labs"
-        )
-        m.add_layer_control()
-
-m.to_streamlit(height=700)
\ No newline at end of file
+        if display_mode == "Fade":
+            # Both mosaics are stacked and faded in the browser, without requesting new tiles
+            layers = [
+                Layer(
+                    url=f"{proxy_url}/tiles/{before_mosaic}/gmap/{{z}}/{{x}}/{{y}}.png",
+                    name="Before event",
+                    attribution="© Planet Labs"
+                ),
+                Layer(
+                    url=f"{proxy_url}/tiles/{after_mosaic}/gmap/{{z}}/{{x}}/{{y}}.png",
+                    name="After event",
+                    attribution="© Planet Labs",
+                    opacity=0.0,
+                    opacity_control=True
+                ),
+            ]
+        else:
+            # The proxy composites both mosaics into a single tile per cell
+            mode = f"mode=swipe&split={swipe_longitude}" if display_mode == "Swipe" else "mode=difference"
+            layers = [
+                Layer(
+                    url=f"{proxy_url}/blend/{before_mosaic}/{after_mosaic}/{{z}}/{{x}}/{{y}}.png?{mode}",
+                    name="Before / After event",
+                    attribution="© Planet Labs"
+                ),
+            ]
+        layers.append(Layer(
+            url=f"{proxy_url}/change/{before_mosaic}/{after_mosaic}/{{z}}/{{x}}/{{y}}.png",
+            name="Burn scars",
+            attribution="© Planet Labs",
+            shown=False,
+            opacity_control=True
+        ))
+
+show_map(center=(-14.2, -63.11), zoom=10, layers=layers, height=700)
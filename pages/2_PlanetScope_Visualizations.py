@@ -1,6 +1,6 @@
 import streamlit as st
-import leafmap.foliumap as leafmap
-from sentinelhub import SHConfig
+from map_cache import Layer, show_map
+from urllib.parse import quote
 
 st.set_page_config(layout="wide")
 
@@ -15,21 +15,17 @@ st.sidebar.image(logo)
 
 st.title("Before and after event with PlanetScope Visualizations")
 
-# Load Sentinel Hub credentials from secrets
-config = SHConfig()
-config.instance_id = st.secrets["sentinelhub"]["instance_id"]
-config.sh_client_id = st.secrets["sentinelhub"]["client_id"]
-config.sh_client_secret = st.secrets["sentinelhub"]["client_secret"]
+# The proxy serves the Sentinel Hub WMS layers as cached XYZ tiles and keeps the credentials server-side
+#proxy_url = "http://localhost:5000"
+proxy_url = "https://reverse-proxy-basemaps.onrender.com"
 
-# Define the WMS URLs
-wms_url = f"https://services.sentinel-hub.com/ogc/wms/{config.instance_id}"
+def wms_tile_url(params):
+    return f"{proxy_url}/wms/{params['layers']}/{{z}}/{{x}}/{{y}}.png?time={quote(params['time'], safe='')}"
 
 Time1 = '2024-08-25T00:00:00Z/2024-08-27T00:00:00Z'
 Time2 = '2024-10-30T00:00:00Z/2024-11-01T00:00:00Z'
 Time3 = '2024-11-04T00:00:00Z/2024-11-06T00:00:00Z'
 
-format = 'image/png'
-transparent = True
 attribution = 'Planet Labs'
 
 # Define the WMS parameters for each layer
@@ -80,106 +76,61 @@ wms_params_layer9 = {
 
 with st.expander("See source code"):
     with st.echo():
-        m = leafmap.Map(center=[-14.51, -64.07], zoom=15)
-        
-        # Add the WMS layers
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer1['layers'],
-            name="True Color - 2024 Aug 26",
-            format=format,
-            time=wms_params_layer1['time'],
-            transparent=transparent,
-            attribution=attribution
-        )
-        
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer2['layers'],
-            name="False Color - 2024 Aug 26",
-            format=format,
-            time=wms_params_layer2['time'],
-            transparent=transparent,
-            attribution=attribution,
-            shown=False
-        )
-        
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer3['layers'],
-            name="NDVI - 2024 Aug 26",
-            format=format,
-            time=wms_params_layer3['time'],
-            transparent=transparent,
-            attribution=attribution,
-            shown=False
-        )
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer4['layers'],
-            name="True Color - 2024 Oct 10",
-            format=format,
-            time=wms_params_layer4['time'],
-            transparent=transparent,
-            attribution=attribution,
-            shown=False
-        )
-        
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer5['layers'],
-            name="False Color - 2024 Oct 10",
-            format=format,
-            time=wms_params_layer5['time'],
-            transparent=transparent,
-            attribution=attribution,
-            shown=False
-        )
-        
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer6['layers'],
-            name="NDVI - 2024 Oct 10",
-            format=format,
-            time=wms_params_layer6['time'],
-            transparent=transparent,
-            attribution=attribution,
-            shown=False
-        )
-
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer7['layers'],
-            name="True Color - 2024 Nov 05",
-            format=format,
-            time=wms_params_layer7['time'],
-            transparent=transparent,
-            attribution=attribution,
-            shown=False
-        )
-        
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer8['layers'],
-            name="False Color - 2024 Nov 05",
-            format=format,
-            time=wms_params_layer8['time'],
-            transparent=transparent,
-            attribution=attribution,
-            shown=False
-        )
-        
-        m.add_wms_layer(
-            url=wms_url,
-            layers=wms_params_layer9['layers'],
-            name="NDVI - 2024 Nov 05",
-            format=format,
-            time=wms_params_layer9['time'],
-            transparent=transparent,
-            attribution=attribution,
-            shown=False
-        )
-
-        m.add_layer_control()
-
-m.to_streamlit(height=700)
\ No newline at end of file
+        # The WMS layers as tile layers, switched in the layer control without a rerun
+        layers = [
+            Layer(
+                url=wms_tile_url(wms_params_layer1),
+                name="True Color - 2024 Aug 26",
+                attribution=attribution
+            ),
+            Layer(
+                url=wms_tile_url(wms_params_layer2),
+                name="False Color - 2024 Aug 26",
+                attribution=attribution,
+                shown=False
+            ),
+            Layer(
+                url=wms_tile_url(wms_params_layer3),
+                name="NDVI - 2024 Aug 26",
+                attribution=attribution,
+                shown=False
+            ),
+            Layer(
+                url=wms_tile_url(wms_params_layer4),
+                name="True Color - 2024 Oct 10",
+                attribution=attribution,
+                shown=False
+            ),
+            Layer(
+                url=wms_tile_url(wms_params_layer5),
+                name="False Color - 2024 Oct 10",
+                attribution=attribution,
+                shown=False
+            ),
+            Layer(
+                url=wms_tile_url(wms_params_layer6),
+                name="NDVI - 2024 Oct 10",
+                attribution=attribution,
+                shown=False
+            ),
+            Layer(
+                url=wms_tile_url(wms_params_layer7),
+                name="True Color - 2024 Nov 05",
+                attribution=attribution,
+                shown=False
+            ),
+            Layer(
+                url=wms_tile_url(wms_params_layer8),
+                name="False Color - 2024 Nov 05",
+                attribution=attribution,
+                shown=False
+            ),
+            Layer(
+                url=wms_tile_url(wms_params_layer9),
+                name="NDVI - 2024 Nov 05",
+                attribution=attribution,
+                shown=False
+            ),
+        ]
+
+show_map(center=(-14.51, -64.07), zoom=15, layers=layers, height=700)
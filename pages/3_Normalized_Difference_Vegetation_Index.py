@@ -1,7 +1,7 @@
 import streamlit as st
 import plotly.graph_objects as go
-from sentinelhub import SHConfig, SentinelHubStatistical, DataCollection, BBox, CRS
-import pandas as pd
+from charts import add_series, paginated_table
+from index_stats import index_frame, progressive_statistics
 
 st.set_page_config(layout="wide")
 
@@ -16,132 +16,35 @@ logo = "https://upload.wikimedia.org/wikipedia/commons/3/39/Planet_logo_New.png"
 st.sidebar.image(logo)
 
 
-# Load Sentinel Hub credentials from secrets
-config = SHConfig()
-config.instance_id = st.secrets["sentinelhub"]["instance_id"]
-config.sh_client_id = st.secrets["sentinelhub"]["client_id"]
-config.sh_client_secret = st.secrets["sentinelhub"]["client_secret"]
-
 # Display the figure in Streamlit
 st.title('NDVI Over Time with Standard Deviation')
 
 with st.expander("See source code"):
     with st.echo():
-        # Define the area of interest and time range
-        bbox = BBox(bbox=[-63.157139, -14.375157, -63.145466, -14.365157], crs=CRS.WGS84)
-        time_interval = ('2024-03-31T00:00:00Z', '2024-11-20T00:00:00Z')
-
-        # Define the cloud cover threshold (e.g., 50%)
-        cloud_cover_threshold = 0.1
-
-        # Define the evalscript for NDVI with cloud cover filter
-        evalscript = f"""
-        //VERSION=3
-        function setup() {{
-            return {{
-                input: ["B08", "B04", "CLM", "dataMask"],
-                output: [
-                    {{ id: "default", bands: 1 }},
-                    {{ id: "dataMask", bands: 1 }}
-                ]
-            }};
-        }}
-
-        function evaluatePixel(sample) {{
-            // Cloud mask: exclude pixels with cloud cover greater than the threshold
-            if (sample.CLM > {cloud_cover_threshold}) {{
-                return {{ default: [null], dataMask: [0] }};
-            }}
-            let ndvi = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
-            return {{ default: [ndvi], dataMask: [sample.dataMask] }};
-        }}
-        """
-
-        # Define a function to get the data and cache the response
-        @st.cache_data
-        def get_statistical_data_ndvi():
-            request = SentinelHubStatistical(
-                aggregation={
-                    "timeRange": {
-                        "from": time_interval[0],
-                        "to": time_interval[1]
-                    },
-                    "aggregationInterval": {
-                        "of": "P1D"
-                    },
-                    "evalscript": evalscript
-                },
-                input_data=[
-                    {
-                        "type": DataCollection.SENTINEL2_L2A.api_id,
-                        "dataFilter": {
-                            "timeRange": {
-                                "from": time_interval[0],
-                                "to": time_interval[1]
-                            }
-                        }
-                    }
-                ],
-                bbox=bbox,
-                config=config
-            )
-            return request.get_data()
-
-        # Get the data
-        response = get_statistical_data_ndvi()
-
-        # Extract the data
-        dates = []
-        values = []
-        std_devs = []
-        for interval in response[0]['data']:
-            dates.append(interval['interval']['to'])
-            values.append(interval['outputs']['default']['bands']['B0']['stats']['mean'])
-            std_devs.append(interval['outputs']['default']['bands']['B0']['stats']['stDev'])
-
-        # Create a DataFrame
-        df = pd.DataFrame({'Date': dates, 'NDVI': values, 'StdDev': std_devs})
-
-        # Ensure the 'NDVI' column contains only numeric values
-        df['NDVI'] = pd.to_numeric(df['NDVI'], errors='coerce')
-        df['StdDev'] = pd.to_numeric(df['StdDev'], errors='coerce')
-
-
-        # Filter out NaN values
-        df = df.dropna()
-
-        # Create upper and lower bounds for the shaded region
-        df['Upper'] = df['NDVI'] + df['StdDev']
-        df['Lower'] = df['NDVI'] - df['StdDev']
-
-        # Create a Plotly figure with shaded region for standard deviation
-        fig = go.Figure()
+        def build_figure(response, complete):
+            # Extract the NDVI mean and standard deviation
+            df = index_frame(response, 'NDVI')
 
-        # Add the shaded region
-        fig.add_trace(go.Scatter(
-            x=pd.concat([df['Date'], df['Date'][::-1]]),
-            y=pd.concat([df['Upper'], df['Lower'][::-1]]),
-            fill='toself',
-            fillcolor='rgba(0, 100, 80, 0.2)',
-            line=dict(color='rgba(255,255,255,0)'),
-            hoverinfo="skip",
-            showlegend=False
-        ))
+            # Create a Plotly figure with shaded region for standard deviation
+            fig = go.Figure()
 
-        # Add the NDVI line
-        fig.add_trace(go.Scatter(
-            x=df['Date'],
-            y=df['NDVI'],
-            mode='lines',
-            name='NDVI',
-            line=dict(color='rgb(0, 100, 80)')
-        ))
+            # Add the NDVI line with its standard deviation band, decimated to a screen-sized point budget
+            add_series(fig, df, 'Date', 'NDVI', stdev='StdDev', color='rgb(0, 100, 80)', fillcolor='rgba(0, 100, 80, 0.2)')
 
-        # Update layout
-        fig.update_layout(title='NDVI Over Time with Standard Deviation', xaxis_title='Date', yaxis_title='NDVI')
+            # Update layout, a coarse preview is marked until the daily values are in
+            title = 'NDVI Over Time with Standard Deviation'
+            fig.update_layout(title=title if complete else f"{title} (loading daily values)", xaxis_title='Date', yaxis_title='NDVI')
+            return df, fig
 
+        # Get the statistics shared by all index pages: a coarse preview right away, then the
+        # daily values as they arrive
+        statistics = progressive_statistics()
 
-st.plotly_chart(fig)
+# Display the figure in Streamlit and refine it in place as the daily values arrive
+chart = st.empty()
+for step, (response, complete) in enumerate(statistics):
+    df, fig = build_figure(response, complete)
+    chart.plotly_chart(fig, key=f"statistics-{step}")
 
-# Debugging: Print the DataFrame to inspect the data
-st.write(df)
\ No newline at end of file
+# Inspect the data one page at a time
+paginated_table(df)
\ No newline at end of file
@@ -1,7 +1,10 @@
 import streamlit as st
 import plotly.graph_objects as go
-from sentinelhub import SHConfig, SentinelHubStatistical, DataCollection, BBox, CRS
-import pandas as pd
+from charts import add_series, paginated_table
+from index_stats import BBOX, TIME_INTERVAL, acquisition_dates, get_stats_store, index_frame, progressive_statistics
+from burn_severity import (
+    MAX_SEVERITY_CLOUD_COVER, SEVERITY_COLORS, area_frame, burned_area, class_counts, severity_image, severity_raster
+)
 
 st.set_page_config(layout="wide")
 
@@ -19,130 +22,76 @@ st.sidebar.image(logo)
 
 
 
-# Load Sentinel Hub credentials from secrets
-config = SHConfig()
-config.instance_id = st.secrets["sentinelhub"]["instance_id"]
-config.sh_client_id = st.secrets["sentinelhub"]["client_id"]
-config.sh_client_secret = st.secrets["sentinelhub"]["client_secret"]
+@st.cache_data(ttl=3600)
+def get_acquisitions():
+    return acquisition_dates(get_stats_store(), BBOX, TIME_INTERVAL)
+
+
+@st.cache_data
+def get_severity_raster(pre_day, post_day):
+    return severity_raster(BBOX, pre_day, post_day)
+
 
 st.title('Burn Ratio Over Time with Standard Deviation')
 
 with st.expander("See source code"):
     with st.echo():
-        # Define the area of interest and time range
-        bbox = BBox(bbox=[-63.157139, -14.375157, -63.145466, -14.365157], crs=CRS.WGS84)
-        time_interval = ('2024-03-31T00:00:00Z', '2024-11-20T00:00:00Z')
-
-        # Define the cloud cover threshold (e.g., 50%)
-        cloud_cover_threshold = 0.1
-
-        # Define the evalscript for Burn Ratio index with cloud cover filter
-        evalscript = f"""
-        //VERSION=3
-        function setup() {{
-            return {{
-                input: ["B08", "B04", "CLM", "dataMask"],
-                output: [
-                    {{ id: "default", bands: 1 }},
-                    {{ id: "dataMask", bands: 1 }}
-                ]
-            }};
-        }}
-
-        function evaluatePixel(sample) {{
-            // Cloud mask: exclude pixels with cloud cover greater than the threshold
-            if (sample.CLM > {cloud_cover_threshold}) {{
-                return {{ default: [null], dataMask: [0] }};
-            }}
-            let burnRatio = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
-            return {{ default: [burnRatio], dataMask: [sample.dataMask] }};
-        }}
-        """
-
-        # Define a function to get the data and cache the response
-        @st.cache_data
-        def get_statistical_data_nbr():
-            request = SentinelHubStatistical(
-                aggregation={
-                    "timeRange": {
-                        "from": time_interval[0],
-                        "to": time_interval[1]
-                    },
-                    "aggregationInterval": {
-                        "of": "P1D"
-                    },
-                    "evalscript": evalscript
-                },
-                input_data=[
-                    {
-                        "type": DataCollection.SENTINEL2_L2A.api_id,
-                        "dataFilter": {
-                            "timeRange": {
-                                "from": time_interval[0],
-                                "to": time_interval[1]
-                            }
-                        }
-                    }
-                ],
-                bbox=bbox,
-                config=config
-            )
-            return request.get_data()
-
-        # Get the data
-        response = get_statistical_data_nbr()
-
-        # Extract the data
-        dates = []
-        values = []
-        std_devs = []
-        for interval in response[0]['data']:
-            dates.append(interval['interval']['to'])
-            values.append(interval['outputs']['default']['bands']['B0']['stats']['mean'])
-            std_devs.append(interval['outputs']['default']['bands']['B0']['stats']['stDev'])
-
-        # Create a DataFrame
-        df = pd.DataFrame({'Date': dates, 'Burn Ratio': values, 'StdDev': std_devs})
-
-        # Ensure the 'Burn Ratio' column contains only numeric values
-        df['Burn Ratio'] = pd.to_numeric(df['Burn Ratio'], errors='coerce')
-        df['StdDev'] = pd.to_numeric(df['StdDev'], errors='coerce')
-
-        # Filter out NaN values
-        df = df.dropna()
-
-        # Create upper and lower bounds for the shaded region
-        df['Upper'] = df['Burn Ratio'] + df['StdDev']
-        df['Lower'] = df['Burn Ratio'] - df['StdDev']
-
-        # Create a Plotly figure with shaded region for standard deviation
-        fig = go.Figure()
-
-        # Add the shaded region
-        fig.add_trace(go.Scatter(
-            x=pd.concat([df['Date'], df['Date'][::-1]]),
-            y=pd.concat([df['Upper'], df['Lower'][::-1]]),
-            fill='toself',
-            fillcolor='rgba(255, 165, 0, 0.2)',  # Orange color with transparency
-            line=dict(color='rgba(255,255,255,0)'),
-            hoverinfo="skip",
-            showlegend=False
-        ))
+        def build_figure(response, complete):
+            # Extract the Burn Ratio mean and standard deviation
+            df = index_frame(response, 'NBR', column='Burn Ratio')
 
-        # Add the Burn Ratio line
-        fig.add_trace(go.Scatter(
-            x=df['Date'],
-            y=df['Burn Ratio'],
-            mode='lines',
-            name='Burn Ratio',
-            line=dict(color='rgb(255, 165, 0)')  # Orange color
-        ))
+            # Create a Plotly figure with shaded region for standard deviation
+            fig = go.Figure()
+
+            # Add the Burn Ratio line with its standard deviation band, decimated to a screen-sized point budget
+            add_series(fig, df, 'Date', 'Burn Ratio', stdev='StdDev', color='rgb(255, 165, 0)', fillcolor='rgba(255, 165, 0, 0.2)')
+
+            # Update layout, a coarse preview is marked until the daily values are in
+            title = 'Burn Ratio Over Time with Standard Deviation'
+            fig.update_layout(title=title if complete else f"{title} (loading daily values)", xaxis_title='Date', yaxis_title='Burn Ratio')
+            return df, fig
+
+        # Get the statistics shared by all index pages: a coarse preview right away, then the
+        # daily values as they arrive
+        statistics = progressive_statistics()
 
-        # Update layout
-        fig.update_layout(title='Burn Ratio Over Time with Standard Deviation', xaxis_title='Date', yaxis_title='Burn Ratio')
+# Display the figure in Streamlit and refine it in place as the daily values arrive
+chart = st.empty()
+for step, (response, complete) in enumerate(statistics):
+    df, fig = build_figure(response, complete)
+    chart.plotly_chart(fig, key=f"statistics-{step}")
 
-# Display the figure in Streamlit
-st.plotly_chart(fig)
+# Inspect the data one page at a time
+paginated_table(df)
+
+st.title('Burn Severity (dNBR)')
+
+# Days with a Sentinel-2 acquisition over the AOI, with their scene cloud cover
+acquisitions = get_acquisitions()
+days = sorted(day for day, cloud_cover in acquisitions.items() if cloud_cover <= MAX_SEVERITY_CLOUD_COVER)
+if len(days) < 2:
+    st.warning("Not enough clear acquisitions for a pre-fire and a post-fire scene.")
+    st.stop()
+
+col1, col2 = st.columns(2)
+pre_day = col1.selectbox("Pre-fire acquisition", days, index=0)
+post_day = col2.selectbox("Post-fire acquisition", days, index=len(days) - 1)
+
+with st.expander("See source code"):
+    with st.echo():
+        # Classify every pixel of the AOI into the USGS dNBR severity classes
+        classes = get_severity_raster(pre_day, post_day)
+        areas = area_frame("AOI", class_counts(classes), 10)
+
+        # Burned area per severity class
+        fig_severity = go.Figure(go.Bar(
+            x=areas['severity'],
+            y=areas['hectares'],
+            marker_color=[f"rgb{tuple(color)}" for color in SEVERITY_COLORS.tolist()],
+        ))
+        fig_severity.update_layout(title=f'Burned Area per Severity Class, {pre_day} to {post_day}', yaxis_title='Hectares')
 
-# Debugging: Print the DataFrame to inspect the data
-st.write(df)
\ No newline at end of file
+col1, col2 = st.columns([2, 1])
+col1.plotly_chart(fig_severity)
+col2.image(severity_image(classes), caption="dNBR severity", width="stretch")
+st.metric("Burned area", f"{burned_area(areas).sum():.1f} ha")
@@ -0,0 +1,41 @@
+import importlib
+import threading
+
+import streamlit as st
+from streamlit import runtime
+
+# Imports the heavy dependencies of the pages in a background thread once per process, so
+# the pages visited after the first one do not wait for them. It is started by Home.py and
+# by the modules every other page imports. A page that needs a module while it is still
+# being imported waits for that import to finish instead of starting it again.
+
+# In the order of their import cost, see benchmarks/bench_imports.py
+PRELOAD_MODULES = ("leafmap.foliumap", "pandas", "sentinelhub", "sh_client", "plotly.express")
+
+
+def preload(modules):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            # The page that needs the module reports the error when it imports it
+            pass
+
+
+@st.cache_resource
+def start_preload():
+    # Only in the Streamlit server, not in the command line tools importing the modules
+    if not runtime.exists():
+        return None
+    try:
+        settings = st.secrets.get("preload", {})
+    except FileNotFoundError:
+        # No secrets.toml, the preload is optional and runs with its defaults
+        settings = {}
+    if not settings.get("enabled", True):
+        return None
+    thread = threading.Thread(
+        target=preload, args=(tuple(settings.get("modules", PRELOAD_MODULES)),), name="preload", daemon=True
+    )
+    thread.start()
+    return thread
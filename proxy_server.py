@@ -1,19 +1,543 @@
-from fastapi import FastAPI, Response
-import requests
+import asyncio
+import logging
+import re
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+from urllib.parse import urlencode, urlsplit
+
+from fastapi import FastAPI, HTTPException, Query, Response
+from starlette.concurrency import run_in_threadpool
+import httpx
 import toml
 
-app = FastAPI()
+from proxy_metrics import (
+    CACHE_BYTES,
+    CACHE_EVENTS,
+    UPSTREAM_BYTES_IN,
+    UPSTREAM_CIRCUIT_OPEN,
+    UPSTREAM_ERRORS,
+    UPSTREAM_HEDGES,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_LATENCY,
+    UPSTREAM_RESPONSES,
+    MetricsMiddleware,
+    registry,
+)
+from tile_archive import MBTilesArchive, MBTilesWriter
+from tile_cache import TileCache, is_fresh, parse_cache_control
+from tile_grid import count_tiles, tile_bounds, tile_bounds_mercator, tile_pyramid
+from tile_ops import (
+    apply_colormap,
+    blend,
+    brightness_drop,
+    change_magnitude,
+    decode_tile,
+    difference,
+    encode_png,
+    swipe,
+)
+from upstream_policy import CircuitBreaker, CircuitOpenError, LatencyWindow
 
 # Load the API key from secrets.toml
 secrets = toml.load(".streamlit/secrets.toml")
 API_KEY = secrets["planet"]["api_key"]
 
+# Optional proxy settings, see README
+proxy_settings = secrets.get("proxy", {})
+
+PLANET_TILES_URL = "https://tiles.planet.com/basemaps/v1/planet-tiles"
+
+# Sentinel Hub WMS layers are proxied as XYZ tiles so the instance id stays on the server
+SENTINEL_HUB_INSTANCE_ID = secrets.get("sentinelhub", {}).get("instance_id")
+SENTINEL_HUB_WMS_URL = "https://services.sentinel-hub.com/ogc/wms"
+WMS_LAYERS = set(proxy_settings.get("wms_layers", ["1_TRUE-COLOR", "2_FALSE-COLOR", "3_NDVI"]))
+WMS_CACHE_TTL = int(proxy_settings.get("wms_cache_ttl", 7 * 24 * 3600))
+
+# Monthly mosaics never change, so tiles without caching headers are kept for 30 days
+tile_cache = TileCache(
+    directory=proxy_settings.get("cache_dir", ".tile_cache"),
+    max_bytes=int(proxy_settings.get("cache_max_mb", 1024)) * 1024 * 1024,
+    default_ttl=int(proxy_settings.get("cache_default_ttl", 30 * 24 * 3600)),
+)
+
+# Upstream connection pool, shared by all requests for the lifetime of the app
+MAX_CONNECTIONS_PER_HOST = int(proxy_settings.get("max_connections_per_host", 32))
+UPSTREAM_TIMEOUT = float(proxy_settings.get("upstream_timeout", 30))
+upstream = {}
+
+# Tail latency controls, see README
+STALE_WHILE_REVALIDATE = float(proxy_settings.get("stale_while_revalidate", 7 * 24 * 3600))
+HEDGE_QUANTILE = float(proxy_settings.get("hedge_quantile", 0.95))
+HEDGE_MIN_DELAY = float(proxy_settings.get("hedge_min_delay", 0.05))
+HEDGE_DEFAULT_DELAY = float(proxy_settings.get("hedge_default_delay", 1.0))
+CIRCUIT_FAILURE_THRESHOLD = int(proxy_settings.get("circuit_failure_threshold", 5))
+CIRCUIT_COOLDOWN = float(proxy_settings.get("circuit_cooldown", 30))
+circuit_breakers = {}
+upstream_latencies = {}
+background_tasks = set()
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    upstream["client"] = httpx.AsyncClient(
+        timeout=UPSTREAM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=int(proxy_settings.get("max_connections", 100)),
+            max_keepalive_connections=int(proxy_settings.get("max_keepalive_connections", 50)),
+            keepalive_expiry=float(proxy_settings.get("keepalive_expiry", 60)),
+        ),
+    )
+    upstream["host_limits"] = {}
+    try:
+        yield
+    finally:
+        # Let background refreshes finish before the connection pool goes away
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await upstream.pop("client").aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+TILE_PATH_RE = re.compile(r"^(?P<mosaic>[^/]+)/gmap/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)(?:\.\w+)?$")
+
+
+def tile_cache_key(tile_path):
+    # Key basemap tiles by mosaic/z/x/y so that e.g. "{y}" and "{y}.png" share an entry
+    match = TILE_PATH_RE.match(tile_path)
+    if match is None:
+        return tile_path
+    return "{mosaic}/{z}/{x}/{y}".format(**match.groupdict())
+
+
+def host_limit(host):
+    # One semaphore per upstream host caps the connections a single host can hold
+    limits = upstream["host_limits"]
+    if host not in limits:
+        limits[host] = asyncio.Semaphore(MAX_CONNECTIONS_PER_HOST)
+    return limits[host]
+
+
+def host_state(host, states, factory):
+    if host not in states:
+        states[host] = factory()
+    return states[host]
+
+
+async def upstream_get(url, headers=None):
+    # All upstream requests go through here for the per-host limits, circuit breaker and metrics
+    host = urlsplit(url).netloc
+    breaker = host_state(host, circuit_breakers, lambda: CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN))
+    breaker.before_request()
+    async with host_limit(host):
+        start = time.perf_counter()
+        try:
+            response = await upstream["client"].get(url, headers=headers)
+        except httpx.HTTPError as error:
+            breaker.record_failure()
+            UPSTREAM_ERRORS.inc(host, type(error).__name__)
+            raise
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+    elapsed = time.perf_counter() - start
+    host_state(host, upstream_latencies, LatencyWindow).add(elapsed)
+    UPSTREAM_LATENCY.observe(elapsed, host)
+    UPSTREAM_BYTES_IN.inc(host, amount=len(response.content))
+    UPSTREAM_RESPONSES.inc(host, str(response.status_code))
+    if response.status_code >= 400:
+        UPSTREAM_ERRORS.inc(host, str(response.status_code))
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+async def hedged_get(url, headers=None):
+    # If the upstream has not answered within its recent p95 latency, send a second
+    # identical request and use whichever answers first
+    if not HEDGE_QUANTILE:
+        return await upstream_get(url, headers)
+    latencies = host_state(urlsplit(url).netloc, upstream_latencies, LatencyWindow)
+    delay = max(latencies.quantile(HEDGE_QUANTILE, HEDGE_DEFAULT_DELAY), HEDGE_MIN_DELAY)
+    pending = {asyncio.ensure_future(upstream_get(url, headers))}
+    done, pending = await asyncio.wait(pending, timeout=delay)
+    if not done:
+        UPSTREAM_HEDGES.inc(urlsplit(url).netloc)
+        pending.add(asyncio.ensure_future(upstream_get(url, headers)))
+    try:
+        while True:
+            if not done:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            task = done.pop()
+            # A failed attempt only counts if there is no other one left to wait for
+            if task.exception() is None or (not done and not pending):
+                return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+            task.add_done_callback(retrieve_exception)
+        # Attempts that finished together with the returned one are not used, their
+        # exceptions are retrieved so asyncio does not report them as never retrieved
+        for task in done:
+            retrieve_exception(task)
+
+
+def retrieve_exception(task):
+    if not task.cancelled():
+        task.exception()
+
+
+# Result of a tile lookup, either from the cache or from the upstream
+TileResult = namedtuple("TileResult", ["status_code", "content", "content_type", "cache_status"])
+
+# Upstream fetches currently in progress, keyed by cache key
+inflight = {}
+
+
+async def single_flight(key, fetch):
+    # Concurrent requests for the same key share one fetch and its response buffer.
+    # The fetch is shielded so a disconnecting client does not cancel it for the others.
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def fetch_upstream_tile(key, url, cached, ttl=None):
+    # Fetches a tile and stores it in the cache. Without an explicit ttl the upstream
+    # Cache-Control header decides how long the tile is kept.
+    headers = {}
+    if cached is not None and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    response = await hedged_get(url, headers)
+    if ttl is None:
+        ttl = parse_cache_control(response.headers.get("Cache-Control"), tile_cache.default_ttl)
+
+    # The stale copy is still valid, extend its lifetime and serve it
+    if response.status_code == 304 and cached is not None:
+        await run_in_threadpool(tile_cache.refresh, key, ttl)
+        return TileResult(200, cached.content, cached.content_type, "REVALIDATED")
+
+    content_type = response.headers.get("Content-Type", "")
+    if response.status_code == 200 and ttl and content_type.startswith("image/"):
+        await run_in_threadpool(
+            tile_cache.put, key, response.content, content_type, response.headers.get("ETag"), ttl
+        )
+    return TileResult(response.status_code, response.content, content_type, "MISS")
+
+
+async def refresh_in_background(key, fetch):
+    async def refresh():
+        try:
+            await single_flight(key, fetch)
+        except (httpx.HTTPError, CircuitOpenError):
+            pass
+        except Exception:
+            # E.g. a failed cache write, the stale tile was served already
+            logger.exception("Background refresh of %s failed", key)
+
+    # Keep a reference so the task is not garbage collected before it finishes
+    task = asyncio.ensure_future(refresh())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def get_upstream_tile(key, url, ttl=None):
+    cached = await run_in_threadpool(tile_cache.get, key)
+    if cached is not None and is_fresh(cached):
+        return TileResult(200, cached.content, cached.content_type, "HIT")
+
+    def fetch():
+        return fetch_upstream_tile(key, url, cached, ttl)
+
+    # Serve recently expired tiles right away and refresh them behind the response
+    if cached is not None and time.time() - cached.expires < STALE_WHILE_REVALIDATE:
+        await refresh_in_background(key, fetch)
+        return TileResult(200, cached.content, cached.content_type, "STALE")
+
+    try:
+        return await single_flight(key, fetch)
+    except (httpx.HTTPError, CircuitOpenError):
+        # A stale tile beats an error while the upstream is degraded
+        if cached is not None:
+            return TileResult(200, cached.content, cached.content_type, "STALE")
+        return TileResult(503, b"upstream unavailable", "text/plain", "MISS")
+
+
+def load_archives(paths):
+    for path in paths:
+        archive = MBTilesArchive(path)
+        archives[archive.name] = archive
+
+
+# Offline MBTiles archives keyed by mosaic name. Mosaics found here never go upstream.
+archives = {}
+load_archives(proxy_settings.get("archives", []))
+
+
+def get_archived_tile(mosaic, z, x, y):
+    content = archives[mosaic].get(int(z), int(x), int(y))
+    if content is None:
+        return TileResult(404, b"", "text/plain", "ARCHIVE")
+    return TileResult(200, content, archives[mosaic].media_type, "ARCHIVE")
+
+
+async def get_planet_tile(tile_path):
+    match = TILE_PATH_RE.match(tile_path)
+    if match is not None and match["mosaic"] in archives:
+        return get_archived_tile(match["mosaic"], match["z"], match["x"], match["y"])
+
+    url = f"{PLANET_TILES_URL}/{tile_path}?api_key={API_KEY}"
+    return await get_upstream_tile(tile_cache_key(tile_path), url)
+
+
+def tile_response(tile):
+    return Response(
+        content=tile.content,
+        status_code=tile.status_code,
+        media_type=tile.content_type,
+        headers={"X-Cache": tile.cache_status},
+    )
+
+
+def collect_metrics():
+    CACHE_EVENTS.set(tile_cache.hits, "hit")
+    CACHE_EVENTS.set(tile_cache.misses, "miss")
+    CACHE_EVENTS.set(tile_cache.evictions, "evict")
+    CACHE_BYTES.set(tile_cache.total_bytes)
+    UPSTREAM_IN_FLIGHT.set(len(inflight))
+    for host, breaker in circuit_breakers.items():
+        UPSTREAM_CIRCUIT_OPEN.set(int(breaker.is_open), host)
+
+
+registry.add_collector(collect_metrics)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Rendered on the event loop, where the metrics are updated, to get a consistent snapshot
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/tiles/{tile_path:path}")
-def get_tile(tile_path: str):
-    url = f"https://tiles.planet.com/basemaps/v1/planet-tiles/{tile_path}?api_key={API_KEY}"
-    response = requests.get(url)
-    return Response(content=response.content, media_type=response.headers['Content-Type'])
+async def get_tile(tile_path: str):
+    return tile_response(await get_planet_tile(tile_path))
+
+
+@app.get("/wms/{layer}/{z}/{x}/{y}.png")
+async def get_wms_tile(layer: str, z: int, x: int, y: int, time_range: str = Query(alias="time")):
+    # A Sentinel Hub WMS layer for one time window, rendered on the XYZ grid so that
+    # tiles can be cached by layer/time/z/x/y and shared between views and users
+    if layer not in WMS_LAYERS or SENTINEL_HUB_INSTANCE_ID is None:
+        raise HTTPException(status_code=404, detail=f"unknown layer {layer}")
+    minx, miny, maxx, maxy = tile_bounds_mercator(x, y, z)
+    params = {
+        "SERVICE": "WMS",
+        "REQUEST": "GetMap",
+        "VERSION": "1.3.0",
+        "LAYERS": layer,
+        "TIME": time_range,
+        "CRS": "EPSG:3857",
+        "BBOX": f"{minx},{miny},{maxx},{maxy}",
+        "WIDTH": 256,
+        "HEIGHT": 256,
+        "FORMAT": "image/png",
+        "TRANSPARENT": "true",
+    }
+    url = f"{SENTINEL_HUB_WMS_URL}/{SENTINEL_HUB_INSTANCE_ID}?{urlencode(params)}"
+    return tile_response(await get_upstream_tile(f"wms/{layer}/{time_range}/{z}/{x}/{y}", url, WMS_CACHE_TTL))
+
+
+async def get_source_tiles(mosaics, z, x, y):
+    # Fetches the same cell from several mosaics concurrently. Returns the decoded
+    # pixels, or the first failed TileResult if any source is unavailable.
+    tiles = await asyncio.gather(*(get_planet_tile(f"{mosaic}/gmap/{z}/{x}/{y}.png") for mosaic in mosaics))
+    for tile in tiles:
+        if tile.status_code != 200:
+            return tile
+    return [await run_in_threadpool(decode_tile, tile.content) for tile in tiles]
+
+
+@app.get("/blend/{before}/{after}/{z}/{x}/{y}.png")
+async def get_blend_tile(
+    before: str,
+    after: str,
+    z: int,
+    x: int,
+    y: int,
+    mode: Literal["blend", "swipe", "difference"] = "blend",
+    opacity: float = 0.5,
+    split: Optional[float] = None,
+):
+    # One composited tile of two mosaics: the after mosaic drawn over the before one with
+    # the given opacity, a swipe at longitude `split`, or the per-pixel difference
+    if mode == "swipe" and split is None:
+        raise HTTPException(status_code=422, detail="swipe mode needs a split longitude")
+    sources = await get_source_tiles([before, after], z, x, y)
+    if isinstance(sources, TileResult):
+        return tile_response(sources)
+    before_pixels, after_pixels = sources
+
+    def composite():
+        if mode == "swipe":
+            west, _, east, _ = tile_bounds(x, y, z)
+            split_column = (split - west) / (east - west) * before_pixels.shape[1]
+            return encode_png(swipe(before_pixels, after_pixels, split_column))
+        if mode == "difference":
+            return encode_png(difference(before_pixels, after_pixels))
+        return encode_png(blend(before_pixels, after_pixels, opacity))
+
+    content = await run_in_threadpool(composite)
+    return Response(content=content, media_type="image/png")
+
+
+async def compute_change_tile(key, mosaic_a, mosaic_b, z, x, y, product, threshold):
+    sources = await get_source_tiles([mosaic_a, mosaic_b], z, x, y)
+    if isinstance(sources, TileResult):
+        return sources
+    before, after = sources
+
+    def render():
+        valid = (before[..., 3] > 0) & (after[..., 3] > 0)
+        if product == "burn":
+            values = brightness_drop(before, after, threshold)
+        else:
+            values = change_magnitude(before, after)
+        return encode_png(apply_colormap(values, product, valid))
+
+    content = await run_in_threadpool(render)
+    await run_in_threadpool(tile_cache.put, key, content, "image/png")
+    return TileResult(200, content, "image/png", "MISS")
+
+
+@app.get("/change/{mosaic_a}/{mosaic_b}/{z}/{x}/{y}")
+@app.get("/change/{mosaic_a}/{mosaic_b}/{z}/{x}/{y}.png")
+async def get_change_tile(
+    mosaic_a: str,
+    mosaic_b: str,
+    z: int,
+    x: int,
+    y: int,
+    product: Literal["burn", "magnitude"] = "burn",
+    threshold: float = 0.1,
+):
+    # Colormapped change product between two mosaics: the brightness drop that highlights
+    # burn scars, or the RGB difference magnitude. Rendered tiles share the tile cache.
+    key = f"change/{product}/{threshold:g}/{mosaic_a}/{mosaic_b}/{z}/{x}/{y}"
+    cached = await run_in_threadpool(tile_cache.get, key)
+    if cached is not None and is_fresh(cached):
+        return tile_response(TileResult(200, cached.content, cached.content_type, "HIT"))
+    return tile_response(
+        await single_flight(key, lambda: compute_change_tile(key, mosaic_a, mosaic_b, z, x, y, product, threshold))
+    )
+
+
+async def run_tile_jobs(jobs, total, concurrency, handle):
+    # Runs handle(mosaic, z, x, y) over the jobs with bounded concurrency and prints progress.
+    # handle returns "cached" for tiles it skipped, "failed" for errors and None otherwise.
+    progress = {"done": 0, "cached": 0, "failed": 0}
+    last_report = [0.0]
+
+    def report(final=False):
+        now = time.monotonic()
+        if not final and now - last_report[0] < 1:
+            return
+        last_report[0] = now
+        print(
+            f"{progress['done']}/{total} tiles ({100 * progress['done'] / max(total, 1):.0f}%), "
+            f"{progress['cached']} already cached, {progress['failed']} failed",
+            flush=True,
+        )
+
+    async def worker():
+        # Workers share the job generator, which bounds the number of tiles in flight
+        for job in jobs:
+            try:
+                outcome = await handle(*job)
+            except httpx.HTTPError:
+                outcome = "failed"
+            if outcome is not None:
+                progress[outcome] += 1
+            progress["done"] += 1
+            report()
+
+    async with lifespan(app):
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    report(final=True)
+
+
+async def warm_cache(bbox, min_zoom, max_zoom, mosaics, concurrency):
+    # Fill the tile cache for an area of interest. Tiles that are already cached are
+    # skipped, so an interrupted run resumes where it stopped.
+    async def warm(mosaic, z, x, y):
+        if await run_in_threadpool(tile_cache.contains, f"{mosaic}/{z}/{x}/{y}"):
+            return "cached"
+        tile = await get_planet_tile(f"{mosaic}/gmap/{z}/{x}/{y}.png")
+        return None if tile.status_code == 200 else "failed"
+
+    jobs = ((mosaic, z, x, y) for mosaic in mosaics for z, x, y in tile_pyramid(bbox, min_zoom, max_zoom))
+    await run_tile_jobs(jobs, count_tiles(bbox, min_zoom, max_zoom) * len(mosaics), concurrency, warm)
+
+
+async def export_archive(bbox, min_zoom, max_zoom, mosaic, output, concurrency):
+    # Pack the tiles of an area of interest into an MBTiles archive. Tiles are fetched
+    # through the tile cache, so exporting a warmed area does not go upstream.
+    writer = MBTilesWriter(output, mosaic, bbox, min_zoom, max_zoom)
+
+    async def export(mosaic, z, x, y):
+        tile = await get_planet_tile(f"{mosaic}/gmap/{z}/{x}/{y}.png")
+        if tile.status_code != 200:
+            return "failed"
+        writer.add(z, x, y, tile.content)
+
+    try:
+        jobs = ((mosaic, z, x, y) for z, x, y in tile_pyramid(bbox, min_zoom, max_zoom))
+        await run_tile_jobs(jobs, count_tiles(bbox, min_zoom, max_zoom), concurrency, export)
+    finally:
+        writer.close()
+
 
 if __name__ == '__main__':
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000, log_level="debug")
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Caching proxy for Planet basemap tiles")
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve", help="run the proxy server (default)")
+    serve_parser.add_argument(
+        "--archive", action="append", default=[], help="MBTiles archive to serve offline, can be repeated"
+    )
+    warm_parser = subparsers.add_parser("warm", help="prefetch the tiles of an area of interest into the cache")
+    warm_parser.add_argument("--bbox", type=float, nargs=4, required=True, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    warm_parser.add_argument("--zoom", type=int, nargs=2, required=True, metavar=("MIN", "MAX"))
+    warm_parser.add_argument(
+        "--mosaic",
+        action="append",
+        dest="mosaics",
+        help="mosaic name, can be repeated (default: the Aug and Oct 2024 monthly mosaics)",
+    )
+    warm_parser.add_argument("--concurrency", type=int, default=16)
+    export_parser = subparsers.add_parser("export", help="export the tiles of an area of interest to MBTiles")
+    export_parser.add_argument("--bbox", type=float, nargs=4, required=True, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    export_parser.add_argument("--zoom", type=int, nargs=2, required=True, metavar=("MIN", "MAX"))
+    export_parser.add_argument("--mosaic", required=True)
+    export_parser.add_argument("--output", required=True, help="path of the .mbtiles file to write")
+    export_parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        mosaics = args.mosaics or ["global_monthly_2024_08_mosaic", "global_monthly_2024_10_mosaic"]
+        asyncio.run(warm_cache(args.bbox, args.zoom[0], args.zoom[1], mosaics, args.concurrency))
+    elif args.command == "export":
+        asyncio.run(export_archive(args.bbox, args.zoom[0], args.zoom[1], args.mosaic, args.output, args.concurrency))
+    else:
+        load_archives(getattr(args, "archive", []))
+        uvicorn.run(app, host="0.0.0.0", port=5000, log_level="debug")
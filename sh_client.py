@@ -0,0 +1,86 @@
+import threading
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from sentinelhub import SHConfig, SentinelHubCatalog, SentinelHubDownloadClient, SentinelHubSession
+
+# One Sentinel Hub client per process, shared by all pages, sessions and reruns. The OAuth
+# token is fetched once and refreshed shortly before it expires, and requests reuse the
+# keep-alive connections of a pooled HTTP session instead of opening a new one each.
+
+# Connections kept open per host, enough for the concurrent statistics chunks and AOIs
+POOL_SIZE = 16
+
+# Seconds before expiry at which the token is refreshed
+TOKEN_REFRESH_BEFORE_EXPIRY = 120
+
+
+def load_config():
+    # Load Sentinel Hub credentials from secrets
+    config = SHConfig()
+    config.instance_id = st.secrets["sentinelhub"]["instance_id"]
+    config.sh_client_id = st.secrets["sentinelhub"]["client_id"]
+    config.sh_client_secret = st.secrets["sentinelhub"]["client_secret"]
+    return config
+
+
+class PooledDownloadClient(SentinelHubDownloadClient):
+    # sentinelhub-py sends every request with requests.request, i.e. on a new connection.
+    # This client sends them over the shared session and serializes token refreshes.
+
+    def __init__(self, *, http, token_lock, **kwargs):
+        super().__init__(**kwargs)
+        self.http = http
+        self.token_lock = token_lock
+
+    def _do_download(self, request):
+        if request.url is None:
+            raise ValueError(f"Faulty request {request}, no URL specified.")
+        return self.http.request(
+            request.request_type.value,
+            url=request.url,
+            json=request.post_values,
+            headers=self._prepare_headers(request),
+            timeout=self.config.download_timeout_seconds,
+        )
+
+    def _get_session_headers(self):
+        with self.token_lock:
+            return super()._get_session_headers()
+
+
+class SentinelHubClient:
+
+    def __init__(self, config, pool_size=POOL_SIZE):
+        self.config = config
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.session = SentinelHubSession(config=config, refresh_before_expiry=TOKEN_REFRESH_BEFORE_EXPIRY)
+        # Clients that sentinelhub-py creates on its own reuse the token as well
+        SentinelHubDownloadClient.cache_session(self.session)
+        self.token_lock = threading.Lock()
+
+    def download_client(self, **kwargs):
+        return PooledDownloadClient(
+            http=self.http, token_lock=self.token_lock, session=self.session, config=self.config, **kwargs
+        )
+
+    def get_data(self, request):
+        # Replaces request.get_data() for Process and Statistical API requests
+        for download_request in request.download_list:
+            download_request.save_response = False
+            download_request.return_data = True
+        return self.download_client().download(request.download_list, decode_data=True)
+
+    def catalog(self):
+        catalog = SentinelHubCatalog(config=self.config)
+        catalog.client = self.download_client(default_retry_time=catalog.client.default_retry_time / 1000)
+        return catalog
+
+
+@st.cache_resource
+def get_sentinel_hub_client():
+    return SentinelHubClient(load_config())
@@ -0,0 +1,233 @@
+import calendar
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Persistent on-disk cache for Statistical API responses. Every Streamlit process on the
+# host opens the same SQLite file, so restarts, redeploys and replicas share the results.
+
+# Bytes a stored day is counted with besides its payload, days without data have none
+DAY_ROW_BYTES = 64
+
+
+def request_key(evalscript, aoi, time_interval, collection, aggregation_interval="P1D"):
+    # Identifies a single Statistical API request over one AOI (a bbox or a GeoJSON geometry)
+    payload = json.dumps(
+        [evalscript, aoi, list(time_interval), collection, aggregation_interval], separators=(",", ":"), sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def series_key(evalscript, aoi, collection):
+    # Identifies a daily series of one evalscript over one AOI (a bbox or a GeoJSON
+    # geometry), independent of the time range
+    payload = json.dumps([evalscript, aoi, collection], separators=(",", ":"), sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def catalog_key(aoi, time_interval, collection):
+    # Identifies the acquisitions of a collection over one AOI within a time interval
+    payload = json.dumps(["catalog", aoi, list(time_interval), collection], separators=(",", ":"), sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StatsStore:
+
+    def __init__(self, path, max_bytes, ttl):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Other processes may hold the write lock for a moment, wait for it instead of failing
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # The connection is shared by the threads fetching statistics concurrently
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        # Materialized days of daily series. Days without data are stored with an empty
+        # payload so they are not requested again. Every series also has a row in
+        # responses, keyed by the series, that carries its size, expiry and last access,
+        # so series are evicted together with the responses.
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS days (
+                series TEXT NOT NULL,
+                day TEXT NOT NULL,
+                payload BLOB,
+                fetched REAL NOT NULL,
+                PRIMARY KEY (series, day)
+            )"""
+        )
+        # Files kept next to the store, e.g. statistics grids, are accounted for in responses
+        # as well, with their path in this column and an empty payload
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(responses)")}
+        if "file" not in columns:
+            try:
+                self._db.execute("ALTER TABLE responses ADD COLUMN file TEXT")
+            except sqlite3.OperationalError:
+                # Added by another process in the meantime
+                pass
+        # Series stored before they were accounted for
+        now = time.time()
+        self._db.execute(
+            """INSERT OR IGNORE INTO responses (key, payload, size, expires, accessed)
+            SELECT series, x'', COALESCE(SUM(LENGTH(payload)), 0) + COUNT(*) * ?, ?, ? FROM days GROUP BY series""",
+            (DAY_ROW_BYTES, now + ttl, now),
+        )
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT payload, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            with self._db:
+                self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, response, ttl=None):
+        payload = zlib.compress(json.dumps(response, separators=(",", ":")).encode())
+        if len(payload) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now + (self.ttl if ttl is None else ttl), now),
+            )
+            self._evict(now, keep=key)
+
+    def _evict(self, now, keep):
+        # Drop expired responses, series and files, then the least recently used ones until under budget
+        expired = self._db.execute("SELECT file FROM responses WHERE expires <= ? AND file IS NOT NULL", (now,))
+        for (path,) in expired.fetchall():
+            self._remove_file(path)
+        self._db.execute("DELETE FROM days WHERE series IN (SELECT key FROM responses WHERE expires <= ?)", (now,))
+        self._db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT key, size, file FROM responses WHERE key != ? ORDER BY accessed", (keep,))
+        for key, size, path in rows.fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM days WHERE series = ?", (key,))
+            if path is not None:
+                self._remove_file(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get_file(self, key):
+        # Path of the file kept under key, None if there is none or it expired
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT file, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] is None or row[1] <= now or not os.path.exists(row[0]):
+                return None
+            with self._db:
+                self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put_file(self, key, path, ttl=None):
+        # Takes over a written file, it is deleted when its entry expires or is evicted
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            self._remove_file(path)
+            return
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, size, expires, accessed, file) VALUES (?, x'', ?, ?, ?, ?)",
+                (key, size, now + (self.ttl if ttl is None else ttl), now, path),
+            )
+            self._evict(now, keep=key)
+
+    def _series_alive(self, series, now):
+        # Days of a series that expired are no longer valid, even before they are evicted
+        row = self._db.execute("SELECT expires FROM responses WHERE key = ?", (series,)).fetchone()
+        return row is not None and row[0] > now
+
+    def settled_days(self, series, first_day, last_day, settle_days):
+        # Days in [first_day, last_day] that were fetched at least settle_days after they
+        # ended. Newer data can still arrive for more recent days, so they are fetched again.
+        with self._lock:
+            if not self._series_alive(series, time.time()):
+                return set()
+            rows = self._db.execute(
+                "SELECT day, fetched FROM days WHERE series = ? AND day BETWEEN ? AND ?", (series, first_day, last_day)
+            ).fetchall()
+        settled = set()
+        for day, fetched in rows:
+            day_end = calendar.timegm(time.strptime(day, "%Y-%m-%d")) + 86400
+            if fetched >= day_end + settle_days * 86400:
+                settled.add(day)
+        return settled
+
+    def fetched_days(self, series, first_day, last_day):
+        # Days in [first_day, last_day] that were fetched at all, settled or not
+        with self._lock:
+            if not self._series_alive(series, time.time()):
+                return set()
+            rows = self._db.execute(
+                "SELECT day FROM days WHERE series = ? AND day BETWEEN ? AND ?", (series, first_day, last_day)
+            ).fetchall()
+        return {day for (day,) in rows}
+
+    def put_days(self, series, days, intervals):
+        # intervals maps a day to its Statistical API interval, missing days have no data.
+        # A series expires ttl seconds after it was last written or read.
+        now = time.time()
+        with self._lock, self._db:
+            if not self._series_alive(series, now):
+                self._db.execute("DELETE FROM days WHERE series = ?", (series,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO days (series, day, payload, fetched) VALUES (?, ?, ?, ?)",
+                [
+                    (series, day, zlib.compress(json.dumps(intervals[day]).encode()) if day in intervals else None, now)
+                    for day in days
+                ],
+            )
+            size = self._db.execute(
+                "SELECT COALESCE(SUM(LENGTH(payload)), 0) + COUNT(*) * ? FROM days WHERE series = ?",
+                (DAY_ROW_BYTES, series),
+            ).fetchone()[0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, size, expires, accessed) VALUES (?, x'', ?, ?, ?)",
+                (series, size, now + self.ttl, now),
+            )
+            self._evict(now, keep=series)
+
+    def get_days(self, series, first_day, last_day):
+        now = time.time()
+        with self._lock:
+            if not self._series_alive(series, now):
+                return []
+            rows = self._db.execute(
+                "SELECT payload FROM days WHERE series = ? AND day BETWEEN ? AND ? AND payload IS NOT NULL ORDER BY day",
+                (series, first_day, last_day),
+            ).fetchall()
+            with self._db:
+                self._db.execute(
+                    "UPDATE responses SET accessed = ?, expires = ? WHERE key = ?", (now, now + self.ttl, series)
+                )
+        return [json.loads(zlib.decompress(payload)) for (payload,) in rows]
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+
+# MBTiles archives (https://github.com/mapbox/mbtiles-spec) for serving basemap tiles offline.
+# Rows are stored in the TMS scheme, so y is flipped relative to the XYZ tiles Leaflet requests.
+
+MEDIA_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp"}
+
+# Archives are read through SQLite's memory map, lookups go through the tiles primary key
+MMAP_SIZE = 1 << 34
+
+
+class MBTilesArchive:
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        metadata = dict(self._connection().execute("SELECT name, value FROM metadata").fetchall())
+        self.name = metadata.get("name", os.path.splitext(os.path.basename(path))[0])
+        self.format = metadata.get("format", "png")
+        self.media_type = MEDIA_TYPES.get(self.format, "application/octet-stream")
+
+    def _connection(self):
+        # One read-only connection per thread, SQLite connections must not be shared
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+            connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._local.connection = connection
+        return connection
+
+    def get(self, z, x, y):
+        row = self._connection().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y),
+        ).fetchone()
+        return None if row is None else row[0]
+
+
+class MBTilesWriter:
+
+    def __init__(self, path, name, bounds, min_zoom, max_zoom, format="png"):
+        if os.path.exists(path):
+            os.remove(path)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB, "
+            "PRIMARY KEY (zoom_level, tile_column, tile_row))"
+        )
+        self._db.executemany(
+            "INSERT INTO metadata (name, value) VALUES (?, ?)",
+            [
+                ("name", name),
+                ("format", format),
+                ("type", "baselayer"),
+                ("bounds", ",".join(str(value) for value in bounds)),
+                ("minzoom", str(min_zoom)),
+                ("maxzoom", str(max_zoom)),
+                ("attribution", "© Planet Labs"),
+            ],
+        )
+
+    def add(self, z, x, y, data):
+        self._db.execute(
+            "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+            (z, x, (1 << z) - 1 - y, data),
+        )
+
+    def close(self):
+        self._db.commit()
+        self._db.execute("VACUUM")
+        self._db.close()
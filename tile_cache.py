@@ -0,0 +1,165 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# A cached tile as returned by TileCache.get
+CachedTile = namedtuple("CachedTile", ["content", "content_type", "etag", "expires"])
+
+
+def is_fresh(tile, now=None):
+    return tile.expires > (now if now is not None else time.time())
+
+
+def parse_cache_control(value, default_ttl):
+    # Returns the number of seconds a response may be cached, or None for no-store
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"')
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(int(directives[name]), 0)
+            except ValueError:
+                break
+    return default_ttl
+
+
+class TileCache:
+    # Content-addressed on-disk tile cache with a byte budget and LRU eviction.
+    # Tile bodies are stored once per sha256 digest under <directory>/blobs and an
+    # SQLite index maps each tile key to its digest and HTTP metadata.
+
+    def __init__(self, directory, max_bytes, default_ttl):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Index updates sit on the request path; losing the last few on power loss is harmless
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS tiles (
+                key TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                content_type TEXT,
+                etag TEXT,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)")
+        self._db.commit()
+        self.total_bytes = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM tiles)"
+        ).fetchone()[0]
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, "blobs", digest[:2], digest)
+
+    def get(self, key):
+        # Returns the cached tile (possibly stale) or None. Callers check is_fresh().
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, content_type, etag, expires FROM tiles WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            digest, content_type, etag, expires = row
+            try:
+                with open(self._blob_path(digest), "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                # The blob was removed behind our back, forget the entry
+                self._delete_key(key)
+                self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE tiles SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            return CachedTile(content, content_type, etag, expires)
+
+    def contains(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT expires FROM tiles WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def put(self, key, content, content_type, etag=None, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        size = len(content)
+        if size > self.max_bytes:
+            return
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        now = time.time()
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            if not self._digest_referenced(digest):
+                self.total_bytes += size
+            self._delete_key(key, keep_digest=digest)
+            self._db.execute(
+                "INSERT INTO tiles (key, digest, size, content_type, etag, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, digest, size, content_type, etag, now + ttl, now),
+            )
+            self._evict()
+            self._db.commit()
+
+    def refresh(self, key, ttl=None):
+        # Extends the lifetime of an entry, e.g. after a 304 Not Modified revalidation
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE tiles SET expires = ?, accessed = ? WHERE key = ?", (now + ttl, now, key)
+            )
+            self._db.commit()
+
+    def _digest_referenced(self, digest):
+        return self._db.execute("SELECT 1 FROM tiles WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None
+
+    def _delete_key(self, key, keep_digest=None):
+        row = self._db.execute("SELECT digest, size FROM tiles WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return
+        digest, size = row
+        self._db.execute("DELETE FROM tiles WHERE key = ?", (key,))
+        if digest != keep_digest and not self._digest_referenced(digest):
+            self.total_bytes -= size
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        # Drop least recently used tiles until we are back under the byte budget
+        while self.total_bytes > self.max_bytes:
+            rows = self._db.execute("SELECT key FROM tiles ORDER BY accessed LIMIT 64").fetchall()
+            if not rows:
+                break
+            for (key,) in rows:
+                self._delete_key(key)
+                self.evictions += 1
+                if self.total_bytes <= self.max_bytes:
+                    break
@@ -0,0 +1,58 @@
+import math
+
+# Helpers for the Web Mercator (XYZ / "gmap") tile grid used by Planet basemaps and Leaflet
+
+MAX_LATITUDE = 85.0511287798
+EARTH_HALF_CIRCUMFERENCE = 20037508.342789244
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(x, y, zoom):
+    # Returns the (west, south, east, north) bounds of a tile in WGS84 degrees
+    n = 2 ** zoom
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def tile_bounds_mercator(x, y, zoom):
+    # Returns the (minx, miny, maxx, maxy) bounds of a tile in EPSG:3857 meters
+    size = 2 * EARTH_HALF_CIRCUMFERENCE / 2 ** zoom
+    minx = -EARTH_HALF_CIRCUMFERENCE + x * size
+    maxy = EARTH_HALF_CIRCUMFERENCE - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tiles_in_bbox(bbox, zoom):
+    # bbox is (west, south, east, north) in WGS84 degrees
+    west, south, east, north = bbox
+    min_x, min_y = lonlat_to_tile(west, north, zoom)
+    max_x, max_y = lonlat_to_tile(east, south, zoom)
+    for x in range(min_x, max_x + 1):
+        for y in range(min_y, max_y + 1):
+            yield x, y
+
+
+def tile_pyramid(bbox, min_zoom, max_zoom):
+    for zoom in range(min_zoom, max_zoom + 1):
+        for x, y in tiles_in_bbox(bbox, zoom):
+            yield zoom, x, y
+
+
+def count_tiles(bbox, min_zoom, max_zoom):
+    west, south, east, north = bbox
+    total = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        min_x, min_y = lonlat_to_tile(west, north, zoom)
+        max_x, max_y = lonlat_to_tile(east, south, zoom)
+        total += (max_x - min_x + 1) * (max_y - min_y + 1)
+    return total
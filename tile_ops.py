@@ -0,0 +1,85 @@
+import io
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+# Vectorized pixel operations on decoded basemap tiles. Tiles are handled as
+# (height, width, 4) uint8 RGBA arrays.
+
+
+def decode_tile(content):
+    with Image.open(io.BytesIO(content)) as image:
+        return np.asarray(image.convert("RGBA"))
+
+
+def encode_png(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def blend(before, after, opacity):
+    # Draws the after tile over the before tile with the given opacity
+    opacity = min(max(float(opacity), 0.0), 1.0)
+    mixed = before.astype(np.float32) * (1.0 - opacity) + after.astype(np.float32) * opacity
+    return np.rint(mixed).astype(np.uint8)
+
+
+def swipe(before, after, split_column):
+    # Shows the before tile left of split_column and the after tile right of it
+    columns = np.arange(before.shape[1])
+    return np.where((columns < split_column)[None, :, None], before, after)
+
+
+def difference(before, after):
+    # Absolute per channel difference, opaque wherever either tile has data
+    out = np.abs(before.astype(np.int16) - after.astype(np.int16)).astype(np.uint8)
+    out[..., 3] = np.maximum(before[..., 3], after[..., 3])
+    return out
+
+
+def luminance(pixels):
+    rgb = pixels[..., :3].astype(np.float32) / 255.0
+    return rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def change_magnitude(before, after):
+    # Euclidean RGB distance between both tiles, scaled to 0..1
+    delta = before[..., :3].astype(np.float32) - after[..., :3].astype(np.float32)
+    return np.sqrt(np.square(delta).sum(axis=-1)) / (255.0 * np.sqrt(3.0))
+
+
+def brightness_drop(before, after, threshold):
+    # Darkening between both tiles, the typical signature of a fresh burn scar.
+    # Drops below the threshold are zeroed, larger drops are scaled to 0..1.
+    drop = luminance(before) - luminance(after)
+    drop[drop < threshold] = 0.0
+    return np.clip(drop / 0.5, 0.0, 1.0)
+
+
+# Colormaps as (position, (r, g, b)) stops, rendered to 256 entry lookup tables
+COLORMAPS = {
+    "magnitude": [(0.0, (0, 0, 4)), (0.25, (87, 16, 110)), (0.5, (188, 55, 84)), (0.75, (249, 142, 9)), (1.0, (252, 255, 164))],
+    "burn": [(0.0, (255, 255, 178)), (0.33, (254, 178, 76)), (0.66, (240, 59, 32)), (1.0, (128, 0, 38))],
+}
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(name):
+    stops = COLORMAPS[name]
+    positions = np.linspace(0.0, 1.0, 256)
+    xs = [position for position, _ in stops]
+    return np.stack(
+        [np.interp(positions, xs, [color[channel] for _, color in stops]) for channel in range(3)], axis=-1
+    ).astype(np.uint8)
+
+
+def apply_colormap(values, name, valid):
+    # Maps 0..1 values to RGBA. Zero values and invalid pixels are fully transparent,
+    # so the product can be overlaid on a basemap.
+    index = np.rint(np.clip(values, 0.0, 1.0) * 255).astype(np.uint8)
+    out = np.empty(values.shape + (4,), dtype=np.uint8)
+    out[..., :3] = colormap_lut(name)[index]
+    out[..., 3] = np.where(valid & (index > 0), 255, 0)
+    return out
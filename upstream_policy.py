@@ -0,0 +1,62 @@
+import time
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    # Raised instead of calling an upstream that is known to be degraded
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures and fails fast for `cooldown` seconds.
+    # After the cooldown a single trial request is let through; its outcome closes the
+    # circuit again or restarts the cooldown.
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_request(self):
+        if self.opened_at is None:
+            return
+        if self.trial_in_progress or time.monotonic() - self.opened_at < self.cooldown:
+            raise CircuitOpenError()
+        self.trial_in_progress = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def abandon(self):
+        # The request was cancelled before it had an outcome
+        self.trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_progress = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    # Recent upstream latencies, used to derive the delay before a hedged request
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def quantile(self, q, default):
+        if len(self.samples) < 20:
+            return default
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]